@@ -7,54 +7,66 @@ from datetime import timedelta
 
 load_dotenv()
 
-from admin import admin_bp
-from subadmin import subadmin_bp
-from employee import employee_bp
-from kpi import kpi_bp
-from zones import zones_bp
-from salaryslip import salary_bp
-from invoiceMHD import invoice_bp
-from invoiceEnoylity import invoice_enoylity_bp
-from invoiceEnoylityLLC import enoylity_bp
-from settings import settings_bp
-
-app = Flask(__name__)
-
-app.url_map.strict_slashes = False
-
-CORS(
-    app,
-    resources={r"/*": {"origins": ["https://office.enoylitystudio.com"]}},
-    methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization"],
-    expose_headers=["Authorization"],
-    supports_credentials=False,   # JWT in headers => keep False
-    max_age=86400,
-)
-
-# ✅ Always answer preflight cleanly
-@app.before_request
-def handle_preflight():
-    if request.method == "OPTIONS":
-        return ("", 204)
-
-# ✅ JWT
-app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY", "CHANGE_ME_SUPER_SECRET")
-app.config["JWT_TOKEN_LOCATION"] = ["headers"]
-app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(days=7)
-jwt = JWTManager(app)
-
-# ✅ register blueprints
-app.register_blueprint(admin_bp)
-app.register_blueprint(subadmin_bp)
-app.register_blueprint(employee_bp)
-app.register_blueprint(kpi_bp)
-app.register_blueprint(zones_bp)
-app.register_blueprint(salary_bp)
-app.register_blueprint(invoice_bp)
-app.register_blueprint(invoice_enoylity_bp)
-app.register_blueprint(enoylity_bp)
-app.register_blueprint(settings_bp)
+
+def create_app():
+    from admin import admin_bp
+    from subadmin import subadmin_bp
+    from employee import employee_bp
+    from kpi import kpi_bp
+    from zones import zones_bp
+    from salaryslip import salary_bp
+    from invoiceMHD import invoice_bp
+    from invoiceEnoylity import invoice_enoylity_bp
+    from invoiceEnoylityLLC import enoylity_bp
+    from settings import settings_bp
+    from utils import OrjsonProvider
+
+    app = Flask(__name__)
+    app.json = OrjsonProvider(app)
+
+    app.url_map.strict_slashes = False
+
+    CORS(
+        app,
+        resources={r"/*": {"origins": ["https://office.enoylitystudio.com"]}},
+        methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
+        allow_headers=["Content-Type", "Authorization"],
+        expose_headers=["Authorization"],
+        supports_credentials=False,   # JWT in headers => keep False
+        max_age=86400,
+    )
+
+    # ✅ Always answer preflight cleanly
+    @app.before_request
+    def handle_preflight():
+        if request.method == "OPTIONS":
+            return ("", 204)
+
+    # ✅ JWT
+    app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY", "CHANGE_ME_SUPER_SECRET")
+    app.config["JWT_TOKEN_LOCATION"] = ["headers"]
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(days=7)
+    JWTManager(app)
+
+    # ✅ register blueprints
+    app.register_blueprint(admin_bp)
+    app.register_blueprint(subadmin_bp)
+    app.register_blueprint(employee_bp)
+    app.register_blueprint(kpi_bp)
+    app.register_blueprint(zones_bp)
+    app.register_blueprint(salary_bp)
+    app.register_blueprint(invoice_bp)
+    app.register_blueprint(invoice_enoylity_bp)
+    app.register_blueprint(enoylity_bp)
+    app.register_blueprint(settings_bp)
+
+    return app
+
+
+# Spawned salary-slip render workers re-run this script as __mp_main__; they need none of
+# the app (importing the blueprints would open a Mongo client and rebuild indexes per worker)
+if __name__ != "__mp_main__":
+    app = create_app()
 
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
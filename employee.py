@@ -211,6 +211,10 @@ def generate_unique_employee_id():
         if not db.employees.find_one({"employeeId": emp_id}):
             return emp_id
 
+def _office_key(payload: dict) -> str:
+    """Normalized office/branch/location text; stored as officeKey so readers skip strip/lower."""
+    return (payload.get("office") or payload.get("branch") or payload.get("location") or "").strip().lower()
+
 def resolve_timezone(payload: dict) -> str:
     """
     Store employee.timezone explicitly as:
@@ -225,7 +229,7 @@ def resolve_timezone(payload: dict) -> str:
         return tz
 
     # fallback mapping by office/branch/location
-    office = (payload.get("office") or payload.get("branch") or payload.get("location") or "").strip().lower()
+    office = _office_key(payload)
     if any(x in office for x in ["las vegas", "vegas", "usa", "us", "america"]):
         return "America/Los_Angeles"
     return "Asia/Kolkata"
@@ -488,6 +492,7 @@ def add_employee():
     for opt in ("office", "branch", "location"):
         if data.get(opt) is not None:
             record[opt] = data.get(opt)
+    record["officeKey"] = _office_key(record)
 
     db.employees.insert_one(record)
     return format_response(True, "Employee added successfully", {"employeeId": employee_id}, status=201)
@@ -549,6 +554,9 @@ def update_employee():
         except (ValueError, PermissionError) as e:
             return format_response(False, str(e), None, 400 if isinstance(e, ValueError) else 403)
 
+    if any(k in data for k in ("office", "branch", "location")):
+        data["officeKey"] = _office_key({**current, **data})
+
     data["updated_at"] = _now_utc()
 
     res = db.employees.update_one({"employeeId": emp_id}, {"$set": data})
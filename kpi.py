@@ -1,21 +1,31 @@
+import os
 import re
+import time
 import uuid
 import csv
 import io
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional, Dict, Any, List, Tuple
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, Tuple, Callable, Iterable, Iterator
 from zoneinfo import ZoneInfo
 
-from flask import Blueprint, request, make_response
+from flask import Blueprint, request, g, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt
+from pymongo import UpdateOne, CursorType
 
 from db import db
-from utils import format_response
+from utils import format_response, format_static_response
 
 kpi_bp = Blueprint("kpi", __name__, url_prefix="/kpi")
+logger = logging.getLogger(__name__)
 
 UTC = ZoneInfo("UTC")
 DEFAULT_TZ = ZoneInfo("Asia/Kolkata")
+DEFAULT_TZ_KEY: str = DEFAULT_TZ.key
 
 # If you have legacy timezone names in DB, map them to canonical ones
 TZ_ALIASES = {
@@ -37,8 +47,62 @@ OFFICE_TZ_MAP = {
     "america": "America/Los_Angeles",
 }
 
+# One compiled pass over the office text: leftmost key wins, longest first at the same
+# position (sorted() is stable, so equal lengths keep OFFICE_TZ_MAP order).
+_OFFICE_RE = re.compile("|".join(re.escape(k) for k in sorted(OFFICE_TZ_MAP, key=len, reverse=True)))
+_OFFICE_LOOKUP = {k: ZoneInfo(v) for k, v in OFFICE_TZ_MAP.items()}
+
 ALLOWED_SORT_FIELDS = {"startdate", "deadline", "createdAt", "updatedAt"}
 
+# $text matches whole words (not substrings), so it is opt-in; short terms always use regex
+KPI_TEXT_SEARCH = (os.getenv("KPI_TEXT_SEARCH") or "").strip().lower() in ("1", "true", "yes")
+TEXT_SEARCH_MIN_LEN = 3
+_TEXT_SCORE = {"$meta": "textScore"}
+
+EXPORT_BATCH_SIZE = 1000
+# exhaust cursors need a direct (non-mongos) connection, so keep them opt-in
+KPI_EXPORT_EXHAUST = (os.getenv("KPI_EXPORT_EXHAUST") or "").strip().lower() in ("1", "true", "yes")
+# page counts run beside the page find; size to the server's request concurrency (threads per worker)
+KPI_COUNT_WORKERS = max(1, int(os.getenv("KPI_COUNT_WORKERS") or 8))
+
+_ID_SPLIT_RE = re.compile(r"[,\s]+")
+
+
+# ======================================================
+# Indexes
+# ======================================================
+
+# only hint indexes we know exist; a hint on a missing index fails the query
+_KPI_INDEXES_READY = False
+
+
+def _ensure_indexes():
+    """Create the indexes KPI queries rely on (idempotent; runs at blueprint registration)."""
+    global _KPI_INDEXES_READY
+    try:
+        db.kpi.create_index("kpiId", unique=True, background=True)
+        # list/export: employeeId $in + sort by createdAt, optional startdate range
+        db.kpi.create_index([("employeeId", 1), ("createdAt", -1)], background=True)
+        db.kpi.create_index([("employeeId", 1), ("startdate", 1)], background=True)
+        # caller timezone lookup (every request): employees by employeeId; non-unique, the data isn't guaranteed clean
+        db.employees.create_index("employeeId", background=True)
+        if KPI_TEXT_SEARCH:
+            db.kpi.create_index(
+                [("project_name", "text"), ("employeeName", "text"), ("employeeId", "text")],
+                weights={"project_name": 10, "employeeName": 5, "employeeId": 5},
+                name="kpi_text",
+                background=True,
+            )
+
+        _KPI_INDEXES_READY = True
+    except Exception as e:
+        logger.error("KPI index setup failed: %s", e)
+
+
+@kpi_bp.record_once
+def _on_register(_state):
+    _ensure_indexes()
+
 
 # ======================================================
 # JWT / Permission / Zone helpers
@@ -90,16 +154,22 @@ def _scope() -> Tuple[str, List[str], Dict[str, Any], bool]:
       employeeId: caller employeeId
       permissions: {"KPI":1, "Manage KPI":1, ...}
     """
-    c = _claims()
-    role = (c.get("role") or "").lower()
-    zone_ids = _normalize_zone_ids(c.get("zoneIds"))
-    perms = c.get("permissions") or {}
-    is_admin_all = (role == "admin") and (not zone_ids or "*" in zone_ids)
-    return role, zone_ids, perms, is_admin_all
+    # claims don't change within a request: parse once and keep on flask.g
+    if not hasattr(g, "_kpi_scope"):
+        c = _claims()
+        role = (c.get("role") or "").lower()
+        zone_ids = _normalize_zone_ids(c.get("zoneIds"))
+        perms = c.get("permissions") or {}
+        is_admin_all = (role == "admin") and (not zone_ids or "*" in zone_ids)
+        g._kpi_scope = (role, zone_ids, perms, is_admin_all)
+    return g._kpi_scope
 
 
 def _caller_employee_id() -> str:
-    return (_claims().get("employeeId") or "").strip()
+    # cached per request (flask.g): scope checks call this once per row
+    if not hasattr(g, "_kpi_caller_emp_id"):
+        g._kpi_caller_emp_id = (_claims().get("employeeId") or "").strip()
+    return g._kpi_caller_emp_id
 
 
 def _kpi_mode() -> str:
@@ -109,6 +179,12 @@ def _kpi_mode() -> str:
       - manage : permissions["Manage KPI"] == 1
       - self   : permissions["KPI"] == 1
     """
+    if not hasattr(g, "_kpi_mode"):
+        g._kpi_mode = _kpi_mode_uncached()
+    return g._kpi_mode
+
+
+def _kpi_mode_uncached() -> str:
     role, _zone_ids, perms, _admin_all = _scope()
     if role == "admin":
         return "admin"
@@ -143,19 +219,40 @@ def _now_utc() -> datetime:
     return datetime.now(UTC)
 
 
-def _tz_from_name(name: Optional[str]) -> ZoneInfo:
-    if not name:
-        return DEFAULT_TZ
-    name = TZ_ALIASES.get(name, name)
+@kpi_bp.before_request
+def _stamp_request_time():
+    # one clock read per request: every timestamp a handler writes/compares is the same "now"
+    g.now_utc = _now_utc()
+
+
+@lru_cache(maxsize=512)
+def _tz_from_name_cached(name: str) -> ZoneInfo:
+    # invalid names are cached too, so a bad value costs one failed lookup only
     try:
-        return ZoneInfo(name)
+        return ZoneInfo(TZ_ALIASES.get(name, name))
     except Exception:
         return DEFAULT_TZ
 
 
+def _tz_from_name(name: Optional[str]) -> ZoneInfo:
+    if not name:
+        return DEFAULT_TZ
+    return _tz_from_name_cached(name)
+
+
+# keyed by the tz object itself (not id(tz)) so a recycled id can never return a stale key
+_TZ_KEY_MEMO: Dict[Any, str] = {}
+
+
 def _tz_key(tz: ZoneInfo) -> str:
-    key = getattr(tz, "key", str(tz))
-    return TZ_ALIASES.get(key, key)
+    key = _TZ_KEY_MEMO.get(tz)
+    if key is not None:
+        return key
+    key = getattr(tz, "key", None) or str(tz)
+    key = TZ_ALIASES.get(key, key)
+    if len(_TZ_KEY_MEMO) < 1024:  # ZoneInfo instances are interned; bound it anyway
+        _TZ_KEY_MEMO[tz] = key
+    return key
 
 
 def _employee_zone_id(emp: Dict[str, Any]) -> Optional[str]:
@@ -168,11 +265,11 @@ def _employee_timezone(emp: Dict[str, Any]) -> ZoneInfo:
     if tz_name:
         return _tz_from_name(tz_name)
 
-    office = (emp.get("office") or emp.get("branch") or emp.get("location") or "").strip().lower()
-    for key, tz in OFFICE_TZ_MAP.items():
-        if key in office:
-            return ZoneInfo(tz)
-    return DEFAULT_TZ
+    office = emp.get("officeKey")  # precomputed at employee write time
+    if office is None:
+        office = (emp.get("office") or emp.get("branch") or emp.get("location") or "").strip().lower()
+    m = _OFFICE_RE.search(office)
+    return _OFFICE_LOOKUP[m.group()] if m else DEFAULT_TZ
 
 
 def _as_utc(dt):
@@ -180,6 +277,8 @@ def _as_utc(dt):
         return dt
     if dt.tzinfo is None:
         return dt.replace(tzinfo=UTC)
+    if dt.tzinfo is UTC:
+        return dt
     return dt.astimezone(UTC)
 
 
@@ -187,33 +286,50 @@ def _as_tz(dt, tz: ZoneInfo):
     return _as_utc(dt).astimezone(tz) if isinstance(dt, datetime) else dt
 
 
-def _fmt_date_in_tz(dt, tz: ZoneInfo, f="%Y-%m-%d"):
-    return _as_tz(dt, tz).strftime(f) if isinstance(dt, datetime) else (dt if isinstance(dt, str) else None)
+def _make_formatter(render: Callable[[datetime], str]):
+    """
+    Build a (dt, tz) -> str formatter: datetimes are shifted into tz and rendered,
+    strings pass through, anything else becomes None.
+    """
+    def fmt(dt, tz: ZoneInfo):
+        if type(dt) is datetime:  # PyMongo only hands back plain datetimes
+            return render(_as_utc(dt).astimezone(tz))
+        return dt if isinstance(dt, str) else None
+    return fmt
 
 
-def _fmt_dt_in_tz(dt, tz: ZoneInfo, f="%Y-%m-%d %H:%M:%S"):
-    return _as_tz(dt, tz).strftime(f) if isinstance(dt, datetime) else (dt if isinstance(dt, str) else None)
+# fixed "%Y-%m-%d": skip strftime's format parsing / locale path
+_fmt_date_in_tz = _make_formatter(lambda d: f"{d.year:04d}-{d.month:02d}-{d.day:02d}")
+_fmt_dt_in_tz = _make_formatter(lambda d: d.strftime("%Y-%m-%d %H:%M:%S"))
+_fmt_iso_in_tz = _make_formatter(datetime.isoformat)
 
 
-def _fmt_iso_in_tz(dt, tz: ZoneInfo):
-    return _as_tz(dt, tz).isoformat() if isinstance(dt, datetime) else (dt if isinstance(dt, str) else None)
+def _split_ymd(s: str) -> Tuple[int, int, int]:
+    # fast path for the canonical zero-padded form
+    if len(s) == 10 and s[4] == "-" and s[7] == "-" and s[:4].isdigit() and s[5:7].isdigit() and s[8:].isdigit():
+        return int(s[:4]), int(s[5:7]), int(s[8:])
+    # full ISO datetimes ("YYYY-MM-DDTHH:MM:SS") from the front-end: only the date part is used
+    try:
+        d = datetime.fromisoformat(s)
+    except ValueError:
+        d = datetime.strptime(s, "%Y-%m-%d")  # non-padded "2024-1-5"
+    return d.year, d.month, d.day
 
 
 def _parse_date_in_tz(s: str, field_name: str, tz: ZoneInfo) -> datetime:
     """YYYY-MM-DD -> tz-aware local midnight"""
     try:
-        d = datetime.strptime(s, "%Y-%m-%d")
-        return d.replace(tzinfo=tz)
+        return datetime(*_split_ymd(s), tzinfo=tz)
     except Exception:
         raise ValueError(f"Invalid {field_name}, must be YYYY-MM-DD")
 
 
-def _end_of_day_local(local_dt: datetime) -> datetime:
-    return local_dt.replace(hour=23, minute=59, second=59, microsecond=0)
-
-
 def _parse_eod_in_tz(s: str, field_name: str, tz: ZoneInfo) -> datetime:
-    return _end_of_day_local(_parse_date_in_tz(s, field_name, tz))
+    """YYYY-MM-DD -> tz-aware local 23:59:59 (built in one constructor call)"""
+    try:
+        return datetime(*_split_ymd(s), 23, 59, 59, tzinfo=tz)
+    except Exception:
+        raise ValueError(f"Invalid {field_name}, must be YYYY-MM-DD")
 
 
 def _parse_filter_range_to_utc(sd: str, ed: str, tz: ZoneInfo) -> Tuple[datetime, datetime]:
@@ -226,23 +342,68 @@ def _parse_filter_range_to_utc(sd: str, ed: str, tz: ZoneInfo) -> Tuple[datetime
 # ID + validation helpers
 # ======================================================
 
+def _uuid7() -> uuid.UUID:
+    """
+    Time-ordered UUID (version 7): 48-bit unix ms timestamp + 74 random bits.
+    New kpiIds sort by creation time, so inserts append to the kpiId index.
+    """
+    ts_ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), "big")
+    value = (ts_ms & 0xFFFF_FFFF_FFFF) << 80
+    value |= 0x7 << 76                              # version
+    value |= ((rand >> 62) & 0xFFF) << 64           # rand_a
+    value |= 0b10 << 62                             # RFC 4122 variant
+    value |= rand & ((1 << 62) - 1)                 # rand_b
+    return uuid.UUID(int=value)
+
+
 def _normalize_employee_ids(raw) -> List[str]:
     if raw is None:
         return []
     if isinstance(raw, list):
-        return [str(x).strip() for x in raw if str(x).strip()]
+        return [x for x in map(str.strip, map(str, raw)) if x]
     if isinstance(raw, (int, float)):
         return [str(raw)]
     if isinstance(raw, str):
-        s = raw.strip()
-        if not s:
-            return []
-        parts = [p.strip() for p in s.replace(",", " ").split()]
-        return [p for p in parts if p]
+        return [p for p in _ID_SPLIT_RE.split(raw) if p]
     return []
 
 
+def _apply_search(query: Dict[str, Any], s: str) -> bool:
+    """
+    Add the list/export search clause to query.
+    Returns True when the kpi_text index ($text) was used, so the caller may sort by relevance.
+    """
+    if KPI_TEXT_SEARCH and len(s) >= TEXT_SEARCH_MIN_LEN:
+        query["$text"] = {"$search": s}
+        return True
+    rx = {"$regex": re.escape(s), "$options": "i"}
+    query["$or"] = [
+        {"project_name": rx},
+        {"projectName": rx},    # legacy
+        {"employeeName": rx},
+        {"employeeId": rx},
+    ]
+    return False
+
+
+def _sv(d: Dict[str, Any], *keys: str) -> str:
+    """First non-blank string value among keys, stripped; "" if none."""
+    for k in keys:
+        v = d.get(k)
+        if v and isinstance(v, str):
+            v = v.strip()
+            if v:
+                return v
+    return ""
+
+
 def _coerce_quality_point(raw) -> int:
+    # exact-type fast paths for the common payloads; anything else keeps int() semantics
+    if type(raw) is int and raw in (-1, 1):
+        return raw
+    if type(raw) is str and raw in ("-1", "1"):
+        return int(raw)
     try:
         val = int(raw)
     except Exception:
@@ -257,16 +418,33 @@ def _coerce_quality_point(raw) -> int:
 # ======================================================
 
 def _caller_timezone_key() -> str:
+    # cached per request (flask.g): one employees lookup per request, not per row
+    if not hasattr(g, "_kpi_caller_tz_key"):
+        g._kpi_caller_tz_key = _caller_timezone_key_uncached()
+    return g._kpi_caller_tz_key
+
+
+def _caller_timezone_key_uncached() -> str:
     emp_id = _caller_employee_id()
     if not emp_id:
-        return _tz_key(DEFAULT_TZ)
+        return DEFAULT_TZ_KEY
+    find_kwargs = {"hint": [("employeeId", 1)]} if _KPI_INDEXES_READY else {}
     emp = db.employees.find_one(
         {"employeeId": emp_id},
-        {"timezone": 1, "tz": 1, "office": 1, "branch": 1, "location": 1}
+        {"timezone": 1, "tz": 1, "officeKey": 1, "office": 1, "branch": 1, "location": 1},
+        **find_kwargs,
     ) or {}
     return _tz_key(_employee_timezone(emp))
 
 
+def _in_caller_timezone(employee_doc: Dict[str, Any], caller_tz: str) -> bool:
+    # fast path: stored tz string (alias-canonicalized) already equals the caller's key
+    doc_tz = (employee_doc.get("timezone") or employee_doc.get("tz") or "").strip()
+    if doc_tz and TZ_ALIASES.get(doc_tz, doc_tz) == caller_tz:
+        return True
+    return _tz_key(_employee_timezone(employee_doc)) == caller_tz
+
+
 def _ensure_employee_scope(employee_doc: Dict[str, Any]):
     """
     Enforces:
@@ -293,13 +471,29 @@ def _ensure_employee_scope(employee_doc: Dict[str, Any]):
         # ✅ If subadmin has MULTI-zone, allow KPI across zones even if timezone differs
         # ✅ If SINGLE-zone, keep the old restriction (same timezone only)
         if (not is_admin_all) and (not _is_multi_zone(zone_ids)):
-            caller_tz = _caller_timezone_key()
-            target_tz = _tz_key(_employee_timezone(employee_doc))
-            if target_tz != caller_tz:
+            if not _in_caller_timezone(employee_doc, _caller_timezone_key()):
                 raise PermissionError("Forbidden: Manage KPI allows same-timezone employees only")
         return
 
 
+def _filter_scope(employee_docs) -> List[Dict[str, Any]]:
+    """
+    Batched _ensure_employee_scope for employee docs already zone-filtered by the query:
+    mode and caller timezone are resolved once, out-of-scope rows are dropped (not raised).
+    """
+    mode = _kpi_mode()
+    if mode == "self":
+        caller_id = _caller_employee_id()
+        return [d for d in employee_docs if (d.get("employeeId") or "") == caller_id]
+
+    _role, zone_ids, _perms, is_admin_all = _scope()
+    if mode == "manage" and (not is_admin_all) and (not _is_multi_zone(zone_ids)):
+        caller_tz = _caller_timezone_key()
+        return [d for d in employee_docs if _in_caller_timezone(d, caller_tz)]
+
+    return list(employee_docs)
+
+
 def _resolve_employee_id_from_request(data: Dict[str, Any]) -> str:
     mode = _kpi_mode()
     if mode == "self":
@@ -307,7 +501,7 @@ def _resolve_employee_id_from_request(data: Dict[str, Any]) -> str:
         if not emp_id:
             raise PermissionError("Missing employeeId in token")
         return emp_id
-    emp_id = (data.get("employeeId") or "").strip()
+    emp_id = _sv(data, "employeeId")
     if not emp_id:
         raise ValueError("Missing employeeId")
     return emp_id
@@ -342,39 +536,66 @@ def _allowed_employee_ids(selected_zone_id: Optional[str] = None) -> List[str]:
 
     cursor = db.employees.find(
         emp_query,
-        {"employeeId": 1, "timezone": 1, "tz": 1, "office": 1, "branch": 1, "location": 1, "zoneId": 1, "zone_id": 1}
+        {"employeeId": 1, "timezone": 1, "tz": 1, "officeKey": 1, "office": 1, "branch": 1, "location": 1, "zoneId": 1, "zone_id": 1}
     )
 
-    apply_tz_filter = (mode == "manage") and (not is_admin_all) and (not _is_multi_zone(zone_ids))
-    caller_tz = _caller_timezone_key() if apply_tz_filter else None
-
-    out: List[str] = []
-    for emp in cursor:
-        emp_id = (emp.get("employeeId") or "").strip()
-        if not emp_id:
-            continue
-        if apply_tz_filter:
-            if _tz_key(_employee_timezone(emp)) != caller_tz:
-                continue
-        out.append(emp_id)
-
-    return out
+    emp_ids = ((e.get("employeeId") or "").strip() for e in _filter_scope(cursor))
+    return [eid for eid in emp_ids if eid]
 
 
 # ======================================================
-# Legacy auto-fix (update docs once on read)
+# Legacy auto-fix (one-off migration + read-path fallback)
 # ======================================================
 
-def _ensure_kpi_has_zone_and_timezone(kpi: Dict[str, Any]) -> Dict[str, Any]:
+_LEGACY_EMP_PROJECTION = {
+    "employeeId": 1, "zoneId": 1, "zone_id": 1, "timezone": 1, "tz": 1,
+    "officeKey": 1, "office": 1, "branch": 1, "location": 1, "name": 1,
+}
+
+
+# migrate_legacy_kpis records completion in db.migrations; until that marker exists, read paths
+# keep normalizing and writing back. The per-process copy only caches the DB answer.
+_LEGACY_MIGRATION_ID = "kpi_legacy_normalize_v1"
+_LEGACY_MIGRATION_RECHECK_SECONDS = 60
+_LEGACY_MIGRATION_DONE = False
+_LEGACY_MIGRATION_CHECKED_AT: Optional[float] = None
+
+_LEGACY_KPI_QUERY = {"$or": [
+    {"zoneId": {"$in": [None, ""]}},
+    {"timezone": {"$in": [None, ""] + list(TZ_ALIASES)}},
+    {"employeeName": {"$in": [None, ""]}},
+    {"projectName": {"$exists": True}},
+    {"Remark": {"$exists": True}},
+]}
+
+
+def _kpi_needs_employee(kpi: Dict[str, Any]) -> bool:
+    return (not kpi.get("zoneId")) or (not kpi.get("timezone")) or (not kpi.get("employeeName"))
+
+
+def _ensure_kpi_has_zone_and_timezone_readonly(
+    kpi: Dict[str, Any],
+    employees: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Legacy normalization (field renames, tz aliases, zoneId/timezone/employeeName); never writes.
+    Returns (kpi with fixes applied in place, Mongo update doc or {}).
+    employees: optional prefetched {employeeId: employee} map (skips find_one).
+    """
     updates: Dict[str, Any] = {}
+    unset: Dict[str, str] = {}
 
-    # normalize project field
-    if not kpi.get("project_name") and kpi.get("projectName"):
-        updates["project_name"] = kpi.get("projectName")
+    # normalize project field (legacy projectName -> project_name)
+    if "projectName" in kpi:
+        if not kpi.get("project_name") and kpi.get("projectName"):
+            updates["project_name"] = kpi.get("projectName")
+        unset["projectName"] = ""
 
-    # normalize remark field
-    if kpi.get("remark") is None and kpi.get("Remark") is not None:
-        updates["remark"] = kpi.get("Remark")
+    # normalize remark field (legacy Remark -> remark)
+    if "Remark" in kpi:
+        if kpi.get("remark") is None and kpi.get("Remark") is not None:
+            updates["remark"] = kpi.get("Remark")
+        unset["Remark"] = ""
 
     # canonicalize timezone name
     if kpi.get("timezone"):
@@ -383,11 +604,11 @@ def _ensure_kpi_has_zone_and_timezone(kpi: Dict[str, Any]) -> Dict[str, Any]:
             updates["timezone"] = canon
 
     # fill missing zoneId/timezone/employeeName from employee
-    if (not kpi.get("zoneId")) or (not kpi.get("timezone")) or (not kpi.get("employeeName")):
-        emp = db.employees.find_one(
-            {"employeeId": kpi.get("employeeId")},
-            {"zoneId": 1, "zone_id": 1, "timezone": 1, "tz": 1, "office": 1, "branch": 1, "location": 1, "name": 1}
-        )
+    if _kpi_needs_employee(kpi):
+        if employees is not None:
+            emp = employees.get(kpi.get("employeeId"))
+        else:
+            emp = db.employees.find_one({"employeeId": kpi.get("employeeId")}, _LEGACY_EMP_PROJECTION)
         if emp:
             if not kpi.get("zoneId"):
                 zid = _employee_zone_id(emp)
@@ -398,23 +619,316 @@ def _ensure_kpi_has_zone_and_timezone(kpi: Dict[str, Any]) -> Dict[str, Any]:
             if not kpi.get("employeeName") and emp.get("name"):
                 updates["employeeName"] = emp.get("name")
 
-    if updates:
-        db.kpi.update_one({"kpiId": kpi.get("kpiId")}, {"$set": updates})
-        kpi = {**kpi, **updates}
+    op: Dict[str, Any] = {}
+    if updates or unset:
+        if updates:
+            op["$set"] = updates
+        if unset:
+            op["$unset"] = unset
+        kpi.update(updates)  # callers own the doc (fresh from the cursor); no copy needed
+        for field in unset:
+            kpi.pop(field, None)
+
+    return kpi, op
+
+
+def _merge_legacy_fix(update: Dict[str, Any], fix: Dict[str, Any]) -> Dict[str, Any]:
+    """Fold a pending legacy fix into a route's own update so both land in one write (route fields win)."""
+    for op, fields in fix.items():
+        update[op] = {**fields, **update.get(op, {})}
+    return update
+
+
+def _load_kpi(kpi_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Single-KPI routes: fetch the KPI and its employee in one round trip ($lookup).
+    Returns (normalized kpi or None, employee or None, pending legacy fix or {}).
+    """
+    docs = list(db.kpi.aggregate([
+        {"$match": {"kpiId": kpi_id}},
+        {"$limit": 1},
+        {"$lookup": {"from": "employees", "localField": "employeeId", "foreignField": "employeeId", "as": "_emp"}},
+        {"$set": {"_emp": {"$arrayElemAt": ["$_emp", 0]}}},
+    ]))
+    if not docs:
+        return None, None, {}
+
+    kpi = docs[0]
+    emp = kpi.pop("_emp", None)
+    if _legacy_migration_done():
+        return kpi, emp, {}
+    kpi, fix = _ensure_kpi_has_zone_and_timezone_readonly(kpi, {kpi.get("employeeId"): emp} if emp else {})
+    return kpi, emp, fix
+
+
+def _ensure_kpi_scope(kpi: Dict[str, Any], emp: Optional[Dict[str, Any]]):
+    """Scope check for one KPI: via its employee, else KPI.zoneId, else admin-all only."""
+    if emp:
+        _ensure_employee_scope(emp)
+    elif kpi.get("zoneId"):
+        _ensure_zone_allowed(kpi.get("zoneId"))
+    else:
+        _role, _zones, _perms, is_admin_all = _scope()
+        if not is_admin_all:
+            raise PermissionError("Forbidden")
+
+
+def _ensure_kpis_have_zone_and_timezone_readonly(
+    kpis: List[Dict[str, Any]],
+) -> Tuple[List[Dict[str, Any]], List[UpdateOne]]:
+    """
+    Batched _ensure_kpi_has_zone_and_timezone_readonly: one employees $in lookup for the
+    whole list. Returns (kpis fixed in memory, UpdateOne ops); never writes.
+    """
+    emp_ids = {k.get("employeeId") for k in kpis if _kpi_needs_employee(k) and k.get("employeeId")}
+    employees: Dict[str, Dict[str, Any]] = {}
+    if emp_ids:
+        cursor = db.employees.find({"employeeId": {"$in": list(emp_ids)}}, _LEGACY_EMP_PROJECTION).batch_size(500)
+        employees = {e.get("employeeId"): e for e in cursor}
+
+    out: List[Dict[str, Any]] = []
+    ops: List[UpdateOne] = []
+    for k in kpis:
+        k, fix = _ensure_kpi_has_zone_and_timezone_readonly(k, employees)
+        if fix:
+            ops.append(UpdateOne({"kpiId": k.get("kpiId")}, fix))
+        out.append(k)
+    return out, ops
+
+
+def _legacy_migration_done() -> bool:
+    """True once the migration marker is in db.migrations (cached for good once seen, else rechecked every minute)."""
+    global _LEGACY_MIGRATION_DONE, _LEGACY_MIGRATION_CHECKED_AT
+    if _LEGACY_MIGRATION_DONE:
+        return True
+
+    now = time.monotonic()
+    if _LEGACY_MIGRATION_CHECKED_AT is not None and now - _LEGACY_MIGRATION_CHECKED_AT < _LEGACY_MIGRATION_RECHECK_SECONDS:
+        return False
+    _LEGACY_MIGRATION_CHECKED_AT = now
+    try:
+        _LEGACY_MIGRATION_DONE = db.migrations.find_one({"_id": _LEGACY_MIGRATION_ID}, {"_id": 1}) is not None
+    except Exception as e:
+        logger.warning("KPI legacy migration marker check failed: %s", e)
+    return _LEGACY_MIGRATION_DONE
+
+
+def _persist_legacy_fixes(ops: List[UpdateOne]):
+    """Read-path write-back until the migration has run; best-effort, the response never depends on it."""
+    if not ops:
+        return
+    try:
+        db.kpi.bulk_write(ops, ordered=False)
+    except Exception as e:
+        logger.warning("KPI legacy write-back failed: %s", e)
+
 
-    return kpi
+def _normalize_legacy_rows(kpis: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """List endpoints: patch legacy rows and persist the fixes, or pass through once migrated."""
+    if _legacy_migration_done():
+        return kpis
+    kpis, ops = _ensure_kpis_have_zone_and_timezone_readonly(kpis)
+    _persist_legacy_fixes(ops)
+    return kpis
+
+
+def migrate_legacy_kpis(batch: int = 500) -> int:
+    """
+    One-off backfill (run via migrate_legacy_kpis.py, not at app start): normalize every
+    legacy KPI doc with unordered bulk_writes per batch, then record completion in
+    db.migrations so read paths stop re-checking. Idempotent; safe to rerun.
+    Returns the number of documents updated.
+    """
+    fixed = 0
+
+    def _flush(chunk: List[Dict[str, Any]]) -> int:
+        _kpis, ops = _ensure_kpis_have_zone_and_timezone_readonly(chunk)
+        if not ops:
+            return 0
+        return db.kpi.bulk_write(ops, ordered=False).modified_count
+
+    chunk: List[Dict[str, Any]] = []
+    for k in db.kpi.find(_LEGACY_KPI_QUERY).batch_size(batch):
+        chunk.append(k)
+        if len(chunk) >= batch:
+            fixed += _flush(chunk)
+            chunk = []
+    if chunk:
+        fixed += _flush(chunk)
+    db.migrations.update_one(
+        {"_id": _LEGACY_MIGRATION_ID},
+        {"$set": {"completedAt": _now_utc(), "modified": fixed}},
+        upsert=True,
+    )
+    logger.info("KPI legacy migration complete: %d updated", fixed)
+    return fixed
 
 
 # ======================================================
 # Output mapper
 # ======================================================
 
-def _map_kpi_row(k: Dict[str, Any], include_punches: bool, include_last_punch: bool) -> Dict[str, Any]:
-    k = _ensure_kpi_has_zone_and_timezone(k)
-    tz = _tz_from_name(k.get("timezone"))
+# everything _map_kpi_row / export / the legacy fixer read, minus punches
+_KPI_ROW_FIELDS = (
+    "kpiId", "zoneId", "employeeId", "employeeName",
+    "project_name", "projectName", "timezone",
+    "startdate", "deadline", "remark", "Remark",
+    "points", "qualityPoints", "createdAt", "updatedAt",
+)
+
+
+def _kpi_projection(include_punches: bool, include_last_punch: bool) -> Dict[str, Any]:
+    """List/export projection: punches only when needed, and just the last one for lastPunch*."""
+    proj: Dict[str, Any] = dict.fromkeys(_KPI_ROW_FIELDS, 1)
+    if include_last_punch:
+        proj["lastPunch"] = 1
+    if include_punches:
+        proj["punches"] = 1
+    elif include_last_punch:
+        proj["punches"] = {"$slice": -1}  # docs punched before lastPunch existed
+    return proj
+
+
+def _count_kwargs(query: Dict[str, Any]) -> Dict[str, Any]:
+    """count_documents hint: pin the employeeId compound index ($text queries can't be hinted)."""
+    if not _KPI_INDEXES_READY or "$text" in query:
+        return {}
+    return {"hint": "employeeId_1_startdate_1" if "startdate" in query else "employeeId_1_createdAt_-1"}
+
+
+def _find_hint(query: Dict[str, Any], sort_spec: List[Tuple[str, Any]]) -> Optional[str]:
+    """employeeId $in + createdAt order is an index walk on employeeId_1_createdAt_-1 ($text must use kpi_text)."""
+    if _KPI_INDEXES_READY and "$text" not in query and sort_spec[0][0] == "createdAt":
+        return "employeeId_1_createdAt_-1"
+    return None
+
+
+# bounded: when every slot is busy the count runs inline instead of queueing behind other requests
+_COUNT_EXECUTOR = ThreadPoolExecutor(max_workers=KPI_COUNT_WORKERS, thread_name_prefix="kpi-count")
+_COUNT_SLOTS = threading.BoundedSemaphore(KPI_COUNT_WORKERS)
+
+
+def _start_count(query: Dict[str, Any]) -> Callable[[], int]:
+    """Start count_documents for query; returns a callable that yields the total."""
+    kwargs = _count_kwargs(query)
+    if not _COUNT_SLOTS.acquire(blocking=False):
+        total = db.kpi.count_documents(query, **kwargs)
+        return lambda: total
+
+    # run under a copy of the request's context vars, so g/app context are there if needed
+    ctx = contextvars.copy_context()
+
+    def _count() -> int:
+        try:
+            return ctx.run(db.kpi.count_documents, query, **kwargs)
+        finally:
+            _COUNT_SLOTS.release()
+
+    return _COUNT_EXECUTOR.submit(_count).result
+
+
+def _fetch_page(
+    query: Dict[str, Any],
+    projection: Dict[str, Any],
+    sort_spec: List[Tuple[str, Any]],
+    page: int,
+    page_size: int,
+    include_total: bool,
+    keyset: Optional[Dict[str, Any]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[int], bool]:
+    """
+    One page of KPI docs -> (rows, total or None, hasMore).
+    include_total=False skips count_documents; hasMore then comes from fetching one extra row.
+    keyset (from _keyset_clause) replaces skip; total still counts the whole result set.
+    """
+    # count and page fetch are independent: overlap the two round trips
+    total_result = _start_count(query) if include_total else None
+
+    # without a usable total (skipped, or keyset offsets), fetch one extra row to learn hasMore
+    probe_more = (not include_total) or bool(keyset)
+
+    if keyset:
+        find_query = {**query, "$and": query.get("$and", []) + [keyset]}
+        skip = 0
+    else:
+        find_query = query
+        skip = (page - 1) * page_size
+
+    cursor = (
+        db.kpi.find(find_query, projection)
+            .sort(sort_spec)
+            .skip(skip)
+            .limit(page_size + 1 if probe_more else page_size)
+    )
+    if (hint := _find_hint(find_query, sort_spec)):
+        cursor = cursor.hint(hint)
+    rows = list(cursor)
+    total = total_result() if total_result else None
+
+    if probe_more:
+        has_more = len(rows) > page_size
+        del rows[page_size:]
+    else:
+        has_more = skip + len(rows) < total
+    return rows, total, has_more
+
+
+def _keyset_clause(data: Dict[str, Any], sort_dir: int) -> Optional[Dict[str, Any]]:
+    """
+    Range-based paging for createdAt order: afterCreatedAt (+ afterId tiebreaker) from the
+    previous page's nextCursor. O(page_size) in Mongo instead of O(skip).
+    """
+    raw = _sv(data, "afterCreatedAt")
+    if not raw:
+        return None
+    try:
+        after_ca = _as_utc(datetime.fromisoformat(raw))
+    except ValueError:
+        raise ValueError("Invalid afterCreatedAt, must be ISO datetime")
+
+    op = "$lt" if sort_dir == -1 else "$gt"
+    after_id = _sv(data, "afterId")
+    if not after_id:
+        return {"createdAt": {op: after_ca}}
+    return {"$or": [{"createdAt": {op: after_ca}}, {"createdAt": after_ca, "kpiId": {op: after_id}}]}
+
+
+def _next_cursor(rows: List[Dict[str, Any]], has_more: bool) -> Optional[Dict[str, Any]]:
+    if not has_more or not rows:
+        return None
+    last = rows[-1]
+    ca = last.get("createdAt")
+    if not isinstance(ca, datetime):
+        return None
+    return {"afterCreatedAt": _as_utc(ca).isoformat(), "afterId": last.get("kpiId")}
+
+
+def _total_pages(total: Optional[int], page_size: int) -> Optional[int]:
+    if total is None:
+        return None
+    return (total + page_size - 1) // page_size if page_size else 0
+
+
+def _tz_and_key(name: Optional[str], cache: Dict[Optional[str], Tuple[ZoneInfo, str]]) -> Tuple[ZoneInfo, str]:
+    """Per-handler memo: rows on a page mostly share one timezone string."""
+    pair = cache.get(name)
+    if pair is None:
+        tz = _tz_from_name(name)
+        pair = cache[name] = (tz, _tz_key(tz))
+    return pair
+
+
+def _map_kpi_row(
+    k: Dict[str, Any],
+    include_punches: bool,
+    include_last_punch: bool,
+    tz_cache: Optional[Dict[Optional[str], Tuple[ZoneInfo, str]]] = None,
+) -> Dict[str, Any]:
+    """k must already be normalized (_ensure_kpi_has_zone_and_timezone_readonly / batched variant)."""
+    tz, tz_key = _tz_and_key(k.get("timezone"), tz_cache if tz_cache is not None else {})
 
     punches = k.get("punches", []) or []
-    last = punches[-1] if punches else {}
+    last = k.get("lastPunch") or (punches[-1] if punches else {})
 
     proj = k.get("project_name") or k.get("projectName") or ""
     rem = k.get("remark") if k.get("remark") is not None else (k.get("Remark") or "")
@@ -425,7 +939,7 @@ def _map_kpi_row(k: Dict[str, Any], include_punches: bool, include_last_punch: b
         "employeeId": k.get("employeeId"),
         "employeeName": k.get("employeeName"),
         "projectName": proj,
-        "timezone": _tz_key(tz),
+        "timezone": tz_key,
 
         "startdate": _fmt_date_in_tz(k.get("startdate"), tz),
         "deadline": _fmt_date_in_tz(k.get("deadline"), tz),
@@ -457,6 +971,48 @@ def _map_kpi_row(k: Dict[str, Any], include_punches: bool, include_last_punch: b
     return row
 
 
+# ======================================================
+# CSV export
+# ======================================================
+
+KPI_CSV_FIELDS = [
+    "EmployeeName", "EmployeeId", "ZoneId",
+    "ProjectName", "Timezone",
+    "StartDate", "Deadline",
+    "Remark", "DeadlinePoints", "QualityPoints",
+    "LastPunchDate", "LastPunchStatus", "LastPunchRemark"
+]
+
+
+def _iter_csv(rows: Iterable[Tuple[Any, ...]]) -> Iterator[str]:
+    """
+    Header + one encoded line per row (tuples in KPI_CSV_FIELDS order);
+    the buffer is reused so memory stays O(one row).
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(KPI_CSV_FIELDS)
+    yield buf.getvalue()
+    for row in rows:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow(row)
+        yield buf.getvalue()
+
+
+def _csv_response(rows: Iterable[Tuple[Any, ...]]) -> Response:
+    def generate():
+        try:
+            yield from _iter_csv(rows)
+        except Exception:
+            # headers are already sent; all we can do is log and cut the download short
+            logger.exception("KPI CSV export failed mid-stream")
+
+    resp = Response(stream_with_context(generate()), content_type="text/csv; charset=utf-8")
+    resp.headers["Content-Disposition"] = 'attachment; filename="kpi_export.csv"'
+    return resp
+
+
 # ======================================================
 # Routes
 # ======================================================
@@ -468,29 +1024,23 @@ def addKpi():
         data = request.get_json(force=True) or {}
 
         employee_id = _resolve_employee_id_from_request(data)
-        project_name = (data.get("projectName") or "").strip()
-        start_str = (data.get("startdate") or data.get("startDate") or "").strip()
-        deadline_str = (data.get("deadline") or "").strip()
+        project_name = _sv(data, "projectName")
+        start_str = _sv(data, "startdate", "startDate")
+        deadline_str = _sv(data, "deadline")
 
-        remark = (
-            data.get("Remark/comment")
-            or data.get("Remark")
-            or data.get("comment")
-            or data.get("remark")
-            or ""
-        )
+        remark = _sv(data, "Remark/comment", "Remark", "comment", "remark")
 
         if not project_name or not deadline_str:
-            return format_response(False, "Missing required fields: projectName, deadline", None, 400)
+            return format_static_response(False, "Missing required fields: projectName, deadline", 400)
 
         employee = db.employees.find_one({"employeeId": employee_id})
         if not employee:
-            return format_response(False, "Employee not found", None, 404)
+            return format_static_response(False, "Employee not found", 404)
 
         _ensure_employee_scope(employee)
 
         tz = _employee_timezone(employee)
-        now_utc = _now_utc()
+        now_utc = g.now_utc
 
         # start date: if not provided, use "today" (local midnight)
         if start_str:
@@ -502,7 +1052,7 @@ def addKpi():
         deadline_local = _parse_eod_in_tz(deadline_str, "deadline", tz)
         deadline_utc = deadline_local.astimezone(UTC)
 
-        kpi_id = str(uuid.uuid4())
+        kpi_id = str(_uuid7())
         kpi_doc = {
             "kpiId": kpi_id,
             "zoneId": _employee_zone_id(employee),
@@ -531,7 +1081,7 @@ def addKpi():
     except ValueError as e:
         return format_response(False, str(e), None, 400)
     except Exception:
-        return format_response(False, "Internal server error", None, 500)
+        return format_static_response(False, "Internal server error", 500)
 
 
 @kpi_bp.route("/updateKPi", methods=["POST"])
@@ -539,43 +1089,30 @@ def addKpi():
 def updateKpi():
     try:
         data = request.get_json(force=True) or {}
-        kpi_id = (data.get("kpiId") or "").strip()
+        kpi_id = _sv(data, "kpiId")
         if not kpi_id:
-            return format_response(False, "Missing kpiId", None, 400)
+            return format_static_response(False, "Missing kpiId", 400)
 
-        kpi = db.kpi.find_one({"kpiId": kpi_id})
+        kpi, emp, fix = _load_kpi(kpi_id)
         if not kpi:
-            return format_response(False, "KPI not found", None, 404)
-
-        kpi = _ensure_kpi_has_zone_and_timezone(kpi)
+            return format_static_response(False, "KPI not found", 404)
 
-        # enforce permission against KPI's employee
-        emp = db.employees.find_one({"employeeId": kpi.get("employeeId")})
-        if emp:
-            _ensure_employee_scope(emp)
-        else:
-            # fallback to KPI zone (if present)
-            if kpi.get("zoneId"):
-                _ensure_zone_allowed(kpi.get("zoneId"))
-            else:
-                _role, _zones, _perms, is_admin_all = _scope()
-                if not is_admin_all:
-                    raise PermissionError("Forbidden")
+        _ensure_kpi_scope(kpi, emp)
 
         updates: Dict[str, Any] = {}
 
-        if (pn := (data.get("projectName") or "").strip()):
+        if (pn := _sv(data, "projectName")):
             updates["project_name"] = pn
 
         # start date update
-        raw_sd = (data.get("startdate") or data.get("startDate") or "").strip()
+        raw_sd = _sv(data, "startdate", "startDate")
         if raw_sd:
             tz = _tz_from_name(kpi.get("timezone"))
             sd_local = _parse_date_in_tz(raw_sd, "startdate", tz)
             updates["startdate"] = sd_local.astimezone(UTC)
 
         # deadline update
-        raw_dl = (data.get("deadline") or "").strip()
+        raw_dl = _sv(data, "deadline")
         if raw_dl:
             tz = _tz_from_name(kpi.get("timezone"))
             dl_local = _parse_eod_in_tz(raw_dl, "deadline", tz)
@@ -592,10 +1129,10 @@ def updateKpi():
             updates["remark"] = remark
 
         if not updates:
-            return format_response(False, "No fields to update", None, 400)
+            return format_static_response(False, "No fields to update", 400)
 
-        updates["updatedAt"] = _now_utc()
-        db.kpi.update_one({"kpiId": kpi_id}, {"$set": updates})
+        updates["updatedAt"] = g.now_utc
+        db.kpi.update_one({"kpiId": kpi_id}, _merge_legacy_fix({"$set": updates}, fix))
 
         return format_response(True, "KPI updated", {"kpiId": kpi_id}, 200)
 
@@ -604,7 +1141,7 @@ def updateKpi():
     except ValueError as e:
         return format_response(False, str(e), None, 400)
     except Exception:
-        return format_response(False, "Internal server error", None, 500)
+        return format_static_response(False, "Internal server error", 500)
 
 
 @kpi_bp.route("/punch", methods=["POST"])
@@ -612,29 +1149,19 @@ def updateKpi():
 def punchKpi():
     try:
         data = request.get_json(force=True) or {}
-        kpi_id = (data.get("kpiId") or "").strip()
+        kpi_id = _sv(data, "kpiId")
         if not kpi_id:
-            return format_response(False, "Missing kpiId", None, 400)
+            return format_static_response(False, "Missing kpiId", 400)
 
-        kpi = db.kpi.find_one({"kpiId": kpi_id})
+        kpi, emp, fix = _load_kpi(kpi_id)
         if not kpi:
-            return format_response(False, "KPI not found", None, 404)
+            return format_static_response(False, "KPI not found", 404)
 
-        kpi = _ensure_kpi_has_zone_and_timezone(kpi)
+        _ensure_kpi_scope(kpi, emp)
 
-        emp = db.employees.find_one({"employeeId": kpi.get("employeeId")})
-        if emp:
-            _ensure_employee_scope(emp)
-        else:
-            if kpi.get("zoneId"):
-                _ensure_zone_allowed(kpi.get("zoneId"))
-            else:
-                _role, _zones, _perms, is_admin_all = _scope()
-                if not is_admin_all:
-                    raise PermissionError("Forbidden")
-
-        now_utc = _now_utc()
+        now_utc = g.now_utc
 
+        # PyMongo hands back naive UTC datetimes (client isn't tz_aware), so _as_utc is only a tzinfo tag here
         deadline = kpi.get("deadline")
         on_time = isinstance(deadline, datetime) and (now_utc <= _as_utc(deadline))
 
@@ -650,34 +1177,37 @@ def punchKpi():
 
         punch_record = {
             "punchDate": now_utc,  # stored UTC
-            "remark": (data.get("remark") or "").strip(),
+            "remark": _sv(data, "remark"),
             "pointChange": change,
             "status": status,
         }
 
         db.kpi.update_one(
             {"kpiId": kpi_id},
-            {
+            _merge_legacy_fix({
                 "$push": {"punches": punch_record},
-                "$set": {"updatedAt": now_utc, "points": new_pts}
-            }
+                # denormalized copy: list/export read this instead of the punches array
+                "$set": {"updatedAt": now_utc, "points": new_pts, "lastPunch": punch_record}
+            }, fix)
         )
 
+        # now_utc is already aware UTC: shift once and render both strings from it
         tz = _tz_from_name(kpi.get("timezone"))
+        now_local = now_utc.astimezone(tz)
         return format_response(True, "Punch recorded", {
             "kpiId": kpi_id,
             "timezone": _tz_key(tz),
-            "punchDate": _fmt_dt_in_tz(now_utc, tz),
+            "punchDate": now_local.strftime("%Y-%m-%d %H:%M:%S"),
             "status": status,
             "pointChange": change,
             "points": new_pts,
-            "updatedAt": _fmt_iso_in_tz(now_utc, tz),
+            "updatedAt": now_local.isoformat(),
         }, 200)
 
     except PermissionError as e:
         return format_response(False, str(e), None, 403)
     except Exception:
-        return format_response(False, "Internal server error", None, 500)
+        return format_static_response(False, "Internal server error", 500)
 
 
 @kpi_bp.route("/getAll", methods=["POST"])
@@ -700,7 +1230,7 @@ def getAll():
         _require_manage_kpi()
         data = request.get_json(force=True) or {}
 
-        selected_zone_id = (data.get("zoneId") or "").strip() or None
+        selected_zone_id = _sv(data, "zoneId") or None
 
         page = max(int(data.get("page", 1)), 1)
         page_size = max(int(data.get("pageSize", 10)), 1)
@@ -712,14 +1242,17 @@ def getAll():
                 "pageSize": page_size,
                 "total": 0,
                 "totalPages": 0,
+                "hasMore": False,
                 "kpis": []
             }, 200)
 
         allowed_set = set(allowed_ids)
 
         # Accept both employeeId (single) and employeeIds (list)
+        if not isinstance(data.get("employeeId") or "", str):
+            raise ValueError("employeeId must be a string")
         requested_ids = []
-        if (single := (data.get("employeeId") or "").strip()):
+        if (single := _sv(data, "employeeId")):
             requested_ids = [single]
         else:
             requested_ids = _normalize_employee_ids(data.get("employeeIds", data.get("employesids")))
@@ -732,24 +1265,20 @@ def getAll():
                     "pageSize": page_size,
                     "total": 0,
                     "totalPages": 0,
+                    "hasMore": False,
                     "kpis": []
                 }, 200)
 
         query: Dict[str, Any] = {"employeeId": {"$in": requested_ids or allowed_ids}}
 
         # search
-        if (s := (data.get("search") or "").strip()):
-            rx = {"$regex": re.escape(s), "$options": "i"}
-            query["$or"] = [
-                {"project_name": rx},
-                {"projectName": rx},    # legacy
-                {"employeeName": rx},
-                {"employeeId": rx},
-            ]
+        text_search = False
+        if (s := _sv(data, "search")):
+            text_search = _apply_search(query, s)
 
         # date filter (on startdate)
-        sd = (data.get("startDate") or "").strip()
-        ed = (data.get("endDate") or "").strip()
+        sd = _sv(data, "startDate")
+        ed = _sv(data, "endDate")
         if sd and ed:
             filter_tz = _tz_from_name(data.get("tz") or data.get("timezone"))
             start_utc, end_utc = _parse_filter_range_to_utc(sd, ed, filter_tz)
@@ -761,26 +1290,38 @@ def getAll():
         sort_dir = -1 if sort_order == "desc" else 1
         sort_field = sort_by if sort_by in ALLOWED_SORT_FIELDS else "createdAt"
 
-        total = db.kpi.count_documents(query)
-        skip = (page - 1) * page_size
-
-        cursor = (
-            db.kpi.find(query)
-                .sort(sort_field, sort_dir)
-                .skip(skip)
-                .limit(page_size)
-        )
-
         include_punches = bool(data.get("includePunches"))
         include_last_punch = bool(data.get("includeLastPunch", True))
+        projection = _kpi_projection(include_punches, include_last_punch)
+
+        # relevance order for $text searches unless the caller asked for a specific sort
+        if text_search and not data.get("sortBy"):
+            projection["score"] = _TEXT_SCORE
+            sort_spec = [("score", _TEXT_SCORE)]
+        elif sort_field == "createdAt":
+            # kpiId tiebreaker keeps keyset pages stable when createdAt collides
+            sort_spec = [("createdAt", sort_dir), ("kpiId", sort_dir)]
+        else:
+            sort_spec = [(sort_field, sort_dir)]
+
+        keyset = _keyset_clause(data, sort_dir) if sort_spec[0][0] == "createdAt" else None
+
+        # includeTotal=false lets deep-page clients skip the count (total/totalPages come back null)
+        include_total = bool(data.get("includeTotal", True))
+        rows, total, has_more = _fetch_page(query, projection, sort_spec, page, page_size, include_total, keyset)
+        next_cursor = _next_cursor(rows, has_more) if sort_spec[0][0] == "createdAt" else None
 
-        out = [_map_kpi_row(k, include_punches, include_last_punch) for k in cursor]
+        kpis = _normalize_legacy_rows(rows)
+        tz_cache: Dict[Optional[str], Tuple[ZoneInfo, str]] = {}
+        out = [_map_kpi_row(k, include_punches, include_last_punch, tz_cache) for k in kpis]
 
         return format_response(True, "KPIs retrieved", {
             "page": page,
             "pageSize": page_size,
             "total": total,
-            "totalPages": (total + page_size - 1) // page_size if page_size else 0,
+            "totalPages": _total_pages(total, page_size),
+            "hasMore": has_more,
+            "nextCursor": next_cursor,
             "kpis": out
         }, 200)
 
@@ -789,7 +1330,7 @@ def getAll():
     except ValueError as e:
         return format_response(False, str(e), None, 400)
     except Exception:
-        return format_response(False, "Internal server error", None, 500)
+        return format_static_response(False, "Internal server error", 500)
 
 
 @kpi_bp.route("/getByKpiId/<kpi_id>", methods=["GET"])
@@ -798,23 +1339,13 @@ def getByKpiId(kpi_id):
     try:
         _kpi_mode()  # must have KPI access (self/manage/admin)
 
-        kpi = db.kpi.find_one({"kpiId": kpi_id})
+        kpi, emp, fix = _load_kpi(kpi_id)
         if not kpi:
-            return format_response(False, "KPI not found", None, 404)
+            return format_static_response(False, "KPI not found", 404)
 
-        kpi = _ensure_kpi_has_zone_and_timezone(kpi)
-
-        emp = db.employees.find_one({"employeeId": kpi.get("employeeId")})
-        if emp:
-            _ensure_employee_scope(emp)
-        else:
-            # fallback: enforce KPI.zoneId if present
-            if kpi.get("zoneId"):
-                _ensure_zone_allowed(kpi.get("zoneId"))
-            else:
-                _role, _zones, _perms, is_admin_all = _scope()
-                if not is_admin_all:
-                    raise PermissionError("Forbidden")
+        _ensure_kpi_scope(kpi, emp)
+        if fix:
+            _persist_legacy_fixes([UpdateOne({"kpiId": kpi_id}, fix)])
 
         payload = _map_kpi_row(kpi, include_punches=True, include_last_punch=True)
         return format_response(True, "KPI retrieved", payload, 200)
@@ -822,7 +1353,7 @@ def getByKpiId(kpi_id):
     except PermissionError as e:
         return format_response(False, str(e), None, 403)
     except Exception:
-        return format_response(False, "Internal server error", None, 500)
+        return format_static_response(False, "Internal server error", 500)
 
 
 @kpi_bp.route("/getByEmployeeId", methods=["POST"])
@@ -842,27 +1373,27 @@ def getByEmployeeId():
         if mode == "self":
             employee_id = _caller_employee_id()
             if not employee_id:
-                return format_response(False, "Missing employeeId in token", None, 403)
+                return format_static_response(False, "Missing employeeId in token", 403)
         else:
-            employee_id = (data.get("employeeId") or "").strip()
+            employee_id = _sv(data, "employeeId")
 
         if not employee_id:
-            return format_response(False, "Missing employeeId", None, 400)
+            return format_static_response(False, "Missing employeeId", 400)
 
         employee = db.employees.find_one({"employeeId": employee_id})
         if not employee:
-            return format_response(False, "Employee not found", None, 404)
+            return format_static_response(False, "Employee not found", 404)
 
         _ensure_employee_scope(employee)
 
         query: Dict[str, Any] = {"employeeId": employee_id}
 
-        if (s := (data.get("search") or "").strip()):
+        if (s := _sv(data, "search")):
             rx = {"$regex": re.escape(s), "$options": "i"}
             query["$or"] = [{"project_name": rx}, {"projectName": rx}]
 
-        sd = (data.get("startDate") or "").strip()
-        ed = (data.get("endDate") or "").strip()
+        sd = _sv(data, "startDate")
+        ed = _sv(data, "endDate")
         if sd and ed:
             emp_tz = _employee_timezone(employee)
             start_utc, end_utc = _parse_filter_range_to_utc(sd, ed, emp_tz)
@@ -870,33 +1401,40 @@ def getByEmployeeId():
 
         page = max(int(data.get("page", 1)), 1)
         page_size = max(int(data.get("pageSize", 10)), 1)
-        skip = (page - 1) * page_size
-
-        total = db.kpi.count_documents(query)
-        cursor = (
-            db.kpi.find(query)
-                .sort("createdAt", -1)
-                .skip(skip)
-                .limit(page_size)
-        )
 
         include_punches = bool(data.get("includePunches"))
         include_last_punch = bool(data.get("includeLastPunch", True))
+        include_total = bool(data.get("includeTotal", True))
+
+        rows, total, has_more = _fetch_page(
+            query,
+            _kpi_projection(include_punches, include_last_punch),
+            [("createdAt", -1), ("kpiId", -1)],
+            page,
+            page_size,
+            include_total,
+            _keyset_clause(data, -1),
+        )
+        next_cursor = _next_cursor(rows, has_more)
 
-        out = [_map_kpi_row(k, include_punches, include_last_punch) for k in cursor]
+        kpis = _normalize_legacy_rows(rows)
+        tz_cache: Dict[Optional[str], Tuple[ZoneInfo, str]] = {}
+        out = [_map_kpi_row(k, include_punches, include_last_punch, tz_cache) for k in kpis]
 
         return format_response(True, f"Found {len(out)} KPI(s) for employee {employee_id}", {
             "page": page,
             "pageSize": page_size,
             "total": total,
-            "totalPages": (total + page_size - 1) // page_size if page_size else 0,
+            "totalPages": _total_pages(total, page_size),
+            "hasMore": has_more,
+            "nextCursor": next_cursor,
             "kpis": out,
         }, 200)
 
     except PermissionError as e:
         return format_response(False, str(e), None, 403)
     except Exception:
-        return format_response(False, "Internal server error", None, 500)
+        return format_static_response(False, "Internal server error", 500)
 
 
 @kpi_bp.route("/setQualityPoint", methods=["POST"])
@@ -906,36 +1444,24 @@ def add_quality_points():
         _require_manage_kpi()
 
         data = request.get_json(force=True) or {}
-        kpi_id = (data.get("kpiId") or data.get("kpi_id") or "").strip()
+        kpi_id = _sv(data, "kpiId", "kpi_id")
         qp_raw = data.get("qualityPoint") or data.get("qualityPoints") or data.get("quality_point")
 
         if not kpi_id or qp_raw is None:
-            return format_response(False, "Missing kpiId or qualityPoint", None, 400)
+            return format_static_response(False, "Missing kpiId or qualityPoint", 400)
 
         qp = _coerce_quality_point(qp_raw)
 
-        kpi = db.kpi.find_one({"kpiId": kpi_id})
+        kpi, emp, fix = _load_kpi(kpi_id)
         if not kpi:
-            return format_response(False, "KPI not found", None, 404)
+            return format_static_response(False, "KPI not found", 404)
 
-        kpi = _ensure_kpi_has_zone_and_timezone(kpi)
+        _ensure_kpi_scope(kpi, emp)
 
-        # enforce scope using employee (NOT KPI.zoneId alone)
-        emp = db.employees.find_one({"employeeId": kpi.get("employeeId")})
-        if emp:
-            _ensure_employee_scope(emp)
-        else:
-            if kpi.get("zoneId"):
-                _ensure_zone_allowed(kpi.get("zoneId"))
-            else:
-                _role, _zones, _perms, is_admin_all = _scope()
-                if not is_admin_all:
-                    raise PermissionError("Forbidden")
-
-        now_utc = _now_utc()
+        now_utc = g.now_utc
         db.kpi.update_one(
             {"kpiId": kpi_id},
-            {"$set": {"qualityPoints": qp, "updatedAt": now_utc}}
+            _merge_legacy_fix({"$set": {"qualityPoints": qp, "updatedAt": now_utc}}, fix)
         )
 
         tz = _tz_from_name(kpi.get("timezone"))
@@ -951,7 +1477,7 @@ def add_quality_points():
     except ValueError as e:
         return format_response(False, str(e), None, 400)
     except Exception:
-        return format_response(False, "Internal server error", None, 500)
+        return format_static_response(False, "Internal server error", 500)
 
 
 @kpi_bp.route("/deleteKpi", methods=["POST"])
@@ -961,37 +1487,26 @@ def deleteKpi():
         _require_manage_kpi()
 
         data = request.get_json(force=True) or {}
-        kpi_id = (data.get("kpiId") or "").strip()
+        kpi_id = _sv(data, "kpiId")
         if not kpi_id:
-            return format_response(False, "Missing kpiId", None, 400)
+            return format_static_response(False, "Missing kpiId", 400)
 
-        kpi = db.kpi.find_one({"kpiId": kpi_id})
+        kpi, emp, _fix = _load_kpi(kpi_id)
         if not kpi:
-            return format_response(False, "KPI not found", None, 404)
-
-        kpi = _ensure_kpi_has_zone_and_timezone(kpi)
+            return format_static_response(False, "KPI not found", 404)
 
-        emp = db.employees.find_one({"employeeId": kpi.get("employeeId")})
-        if emp:
-            _ensure_employee_scope(emp)
-        else:
-            if kpi.get("zoneId"):
-                _ensure_zone_allowed(kpi.get("zoneId"))
-            else:
-                _role, _zones, _perms, is_admin_all = _scope()
-                if not is_admin_all:
-                    raise PermissionError("Forbidden")
+        _ensure_kpi_scope(kpi, emp)
 
         res = db.kpi.delete_one({"kpiId": kpi_id})
         if not res.deleted_count:
-            return format_response(False, "KPI not found", None, 404)
+            return format_static_response(False, "KPI not found", 404)
 
-        return format_response(True, "KPI deleted", None, 200)
+        return format_static_response(True, "KPI deleted", 200)
 
     except PermissionError as e:
         return format_response(False, str(e), None, 403)
     except Exception:
-        return format_response(False, "Internal server error", None, 500)
+        return format_static_response(False, "Internal server error", 500)
 
 
 @kpi_bp.route("/exportCsv", methods=["POST"])
@@ -1014,28 +1529,16 @@ def export_csv():
 
         data = request.get_json(force=True) or {}
 
-        selected_zone_id = (data.get("zoneId") or "").strip() or None
+        selected_zone_id = _sv(data, "zoneId") or None
         allowed_ids = _allowed_employee_ids(selected_zone_id)
         if not allowed_ids:
             # return empty csv (still a valid download)
-            output = io.StringIO()
-            writer = csv.writer(output)
-            writer.writerow([
-                "EmployeeName", "EmployeeId", "ZoneId",
-                "ProjectName", "Timezone",
-                "StartDate", "Deadline",
-                "Remark", "DeadlinePoints", "QualityPoints",
-                "LastPunchDate", "LastPunchStatus", "LastPunchRemark"
-            ])
-            resp = make_response(output.getvalue())
-            resp.headers["Content-Type"] = "text/csv; charset=utf-8"
-            resp.headers["Content-Disposition"] = 'attachment; filename="kpi_export.csv"'
-            return resp
+            return _csv_response(())
 
         allowed_set = set(allowed_ids)
 
         # accept employeeId (single) and employeeIds (list)
-        emp_single = (data.get("employeeId") or "").strip()
+        emp_single = _sv(data, "employeeId")
         emp_list = _normalize_employee_ids(data.get("employeeIds"))
 
         filtered_emp_ids: List[str]
@@ -1047,22 +1550,17 @@ def export_csv():
             filtered_emp_ids = allowed_ids
 
         if not filtered_emp_ids:
-            return format_response(False, "No employees allowed for export", None, 403)
+            return format_static_response(False, "No employees allowed for export", 403)
 
         query: Dict[str, Any] = {"employeeId": {"$in": filtered_emp_ids}}
 
-        search = (data.get("search") or "").strip()
+        text_search = False
+        search = _sv(data, "search")
         if search:
-            rx = {"$regex": re.escape(search), "$options": "i"}
-            query["$or"] = [
-                {"project_name": rx},
-                {"projectName": rx},
-                {"employeeName": rx},
-                {"employeeId": rx}
-            ]
-
-        sd = (data.get("startDate") or "").strip()
-        ed = (data.get("endDate") or "").strip()
+            text_search = _apply_search(query, search)
+
+        sd = _sv(data, "startDate")
+        ed = _sv(data, "endDate")
         if sd and ed:
             filter_tz = _tz_from_name(data.get("tz") or data.get("timezone"))
             start_utc, end_utc = _parse_filter_range_to_utc(sd, ed, filter_tz)
@@ -1077,57 +1575,77 @@ def export_csv():
         page = max(int(data.get("page", 1)), 1)
         page_size = max(int(data.get("pageSize", 10)), 1)
 
-        cursor = db.kpi.find(query).sort(sort_field, sort_dir)
+        projection = _kpi_projection(include_punches=False, include_last_punch=True)
+        if text_search and not data.get("sortBy"):
+            projection["score"] = _TEXT_SCORE
+            sort_spec = [("score", _TEXT_SCORE)]
+        elif sort_field == "createdAt":
+            sort_spec = [("createdAt", sort_dir), ("kpiId", sort_dir)]
+            keyset = _keyset_clause(data, sort_dir)
+            if keyset:
+                query.setdefault("$and", []).append(keyset)
+                page = 1  # keyset replaces skip
+        else:
+            sort_spec = [(sort_field, sort_dir)]
+
+        # exports pull many small docs: large batches; EXHAUST (opt-in, no limit) drops getMore round trips
+        find_kwargs = {"cursor_type": CursorType.EXHAUST} if (export_all and KPI_EXPORT_EXHAUST) else {}
+        cursor = db.kpi.find(query, projection, **find_kwargs).sort(sort_spec).batch_size(EXPORT_BATCH_SIZE)
+        if (hint := _find_hint(query, sort_spec)):
+            cursor = cursor.hint(hint)
         if not export_all:
             cursor = cursor.skip((page - 1) * page_size).limit(page_size)
 
-        fieldnames = [
-            "EmployeeName", "EmployeeId", "ZoneId",
-            "ProjectName", "Timezone",
-            "StartDate", "Deadline",
-            "Remark", "DeadlinePoints", "QualityPoints",
-            "LastPunchDate", "LastPunchStatus", "LastPunchRemark"
-        ]
-
-        output = io.StringIO()
-        writer = csv.DictWriter(output, fieldnames=fieldnames)
-        writer.writeheader()
-
-        for k in cursor:
-            k = _ensure_kpi_has_zone_and_timezone(k)
-            tz = _tz_from_name(k.get("timezone"))
-            punches = k.get("punches", []) or []
-            last = punches[-1] if punches else {}
-            lp_date = last.get("punchDate")
-
-            proj = k.get("project_name") or k.get("projectName") or ""
-            rem = k.get("remark") if k.get("remark") is not None else (k.get("Remark") or "")
-
-            writer.writerow({
-                "EmployeeName": k.get("employeeName", "") or "",
-                "EmployeeId": k.get("employeeId", "") or "",
-                "ZoneId": k.get("zoneId", "") or "",
-                "ProjectName": proj,
-                "Timezone": _tz_key(tz),
-
-                "StartDate": _fmt_dt_in_tz(k.get("startdate"), tz) or "",
-                "Deadline": _fmt_dt_in_tz(k.get("deadline"), tz) or "",
-
-                "Remark": rem,
-                "DeadlinePoints": k.get("points", ""),
-                "QualityPoints": k.get("qualityPoints", ""),
-
-                "LastPunchDate": _fmt_dt_in_tz(lp_date, tz) or "",
-                "LastPunchStatus": last.get("status") or "",
-                "LastPunchRemark": last.get("remark") or "",
-            })
-
-        resp = make_response(output.getvalue())
-        resp.headers["Content-Type"] = "text/csv; charset=utf-8"
-        resp.headers["Content-Disposition"] = 'attachment; filename="kpi_export.csv"'
-        return resp
+        migrated = _legacy_migration_done()
+
+        def docs() -> Iterator[Dict[str, Any]]:
+            if migrated:
+                yield from cursor
+                return
+            # not migrated yet: normalize + write back per EXPORT_BATCH_SIZE chunk (one employees lookup each)
+            chunk: List[Dict[str, Any]] = []
+            for k in cursor:
+                chunk.append(k)
+                if len(chunk) >= EXPORT_BATCH_SIZE:
+                    yield from _normalize_legacy_rows(chunk)
+                    chunk = []
+            if chunk:
+                yield from _normalize_legacy_rows(chunk)
+
+        def rows() -> Iterator[Tuple[Any, ...]]:
+            tz_cache: Dict[Optional[str], Tuple[ZoneInfo, str]] = {}
+            for k in docs():
+                tz, tz_key = _tz_and_key(k.get("timezone"), tz_cache)
+                punches = k.get("punches", []) or []
+                last = k.get("lastPunch") or (punches[-1] if punches else {})
+                lp_date = last.get("punchDate")
+
+                proj = k.get("project_name") or k.get("projectName") or ""
+                rem = k.get("remark") if k.get("remark") is not None else (k.get("Remark") or "")
+
+                # positional, in KPI_CSV_FIELDS order
+                yield (
+                    k.get("employeeName", "") or "",
+                    k.get("employeeId", "") or "",
+                    k.get("zoneId", "") or "",
+                    proj,
+                    tz_key,
+
+                    _fmt_dt_in_tz(k.get("startdate"), tz) or "",
+                    _fmt_dt_in_tz(k.get("deadline"), tz) or "",
+
+                    rem,
+                    k.get("points", ""),
+                    k.get("qualityPoints", ""),
+
+                    _fmt_dt_in_tz(lp_date, tz) or "",
+                    last.get("status") or "",
+                    last.get("remark") or "",
+                )
+
+        return _csv_response(rows())
 
     except PermissionError as e:
         return format_response(False, str(e), None, 403)
     except Exception:
-        return format_response(False, "Internal server error", None, 500)
+        return format_static_response(False, "Internal server error", 500)
@@ -0,0 +1,24 @@
+"""
+One-time migration: normalize legacy KPI docs
+Rule:
+  - projectName -> project_name, Remark -> remark
+  - timezone aliases -> canonical IANA names
+  - missing zoneId / timezone / employeeName -> taken from the owning employee
+
+✅ Uses the app's MongoDB connection (db.py / MONGODB_URI).
+
+Run once per deployment, not per worker:
+  python migrate_legacy_kpis.py
+"""
+
+from kpi import migrate_legacy_kpis
+
+
+def main():
+    fixed = migrate_legacy_kpis()
+    print("✅ KPI legacy migration done")
+    print(f"Collection: kpi, modified={fixed}")
+
+
+if __name__ == "__main__":
+    main()
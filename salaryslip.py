@@ -1,22 +1,317 @@
-from flask import Flask, request, jsonify, send_file, Blueprint
+from flask import Flask, request, jsonify, send_file, Blueprint, Response
 import datetime
 import calendar
 import re
 import requests
 import os
-from dateutil.relativedelta import relativedelta
 import io
+import copy
+import zipfile
+import tempfile
+import hashlib
+import threading
+import atexit
+from collections import OrderedDict
+import multiprocessing
+from itertools import zip_longest
+from dataclasses import dataclass
+from functools import lru_cache
+import json
 from num2words import num2words
 from utils import format_response
 
 # Import standard FPDF without extensions
 from fpdf import FPDF
 
-# Import the settings utility function
-from settings import get_current_salary_settings
-
 salary_bp = Blueprint("salaryslip", __name__, url_prefix="/salary")
 
+LOGO_URL = 'https://www.enoylitystudio.com/wp-content/uploads/2024/02/enoylity-final-logo.png'
+LOCAL_LOGO = 'enoylity-final-logo.png'
+LOGO_PATH = None  # set by _ensure_logo when the blueprint is registered
+
+
+def _ensure_logo():
+    """Download the header logo if it isn't on disk yet; if fetch fails, we'll just skip the logo."""
+    global LOGO_PATH
+    if not os.path.isfile(LOCAL_LOGO):
+        try:
+            resp = requests.get(LOGO_URL, timeout=5)
+            resp.raise_for_status()
+            with open(LOCAL_LOGO, 'wb') as f:
+                f.write(resp.content)
+        except Exception:
+            pass
+    LOGO_PATH = LOCAL_LOGO if os.path.isfile(LOCAL_LOGO) else None
+
+
+# fpdf's parsed logo (dimensions, colour space, pixel data), captured from the first PDF
+_LOGO_INFO = None
+
+
+def _remember_logo_info(info):
+    global _LOGO_INFO
+    if _LOGO_INFO is None:
+        _LOGO_INFO = dict(info)
+
+
+@salary_bp.record_once
+def _on_register(_state):
+    _ensure_logo()
+
+
+def _salary_settings():
+    """
+    settings.get_current_salary_settings, imported on use: render workers import this
+    module to unpickle _render_slip and must not pull in db (a Mongo client + ping).
+    """
+    from settings import get_current_salary_settings
+    return get_current_salary_settings()
+
+
+_EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
+STANDARD_DEDUCTION = 75000
+REBATE_LIMIT = 1275000            # annual income up to this pays no tax
+MARGINAL_RELIEF_LIMIT = 1500000   # relief band is (REBATE_LIMIT, MARGINAL_RELIEF_LIMIT]
+CESS_RATE = 0.04
+
+# Income-tax bands on taxable income: (lower, upper, rate). Income up to ₹4,00,000 is nil.
+_TAX_BANDS = (
+    (400000, 800000, 0.05),
+    (800000, 1200000, 0.10),
+    (1200000, 1600000, 0.15),
+    (1600000, 2000000, 0.20),
+    (2000000, 2400000, 0.25),
+    (2400000, float('inf'), 0.30),
+)
+
+
+def _slab_tax(taxable_income):
+    """Progressive tax over _TAX_BANDS (bands are sorted, so stop at the first one not reached)."""
+    tax = 0.0
+    for lower, upper, rate in _TAX_BANDS:
+        if taxable_income <= lower:
+            break
+        tax += (min(taxable_income, upper) - lower) * rate
+    return tax
+
+
+# Salary components that count towards earnings
+_ALLOWED_EARNINGS = frozenset({
+    'Basic Pay', 'House Rent Allowance',
+    'Performance Bonus', 'Overtime Bonus', 'Special Allowance'
+})
+
+# salary_details fields rendered as "Rs. x.xx" money strings, in output order
+_SALARY_MONEY_KEYS = ('gross_earnings', 'total_deductions', 'net_payable',
+                      'annual_income', 'annual_net_payable')
+
+
+def _rs(amount):
+    return 'Rs. ' + format(amount, '.2f')
+
+
+@lru_cache(maxsize=8192)
+def _num_words(n):
+    """num2words(n) in Indian English; salaries cluster on a few values, so cache by int."""
+    return num2words(n, lang='en_IN')
+
+
+@lru_cache(maxsize=4096)
+def _rupees_in_words(rupees, paise):
+    """The PDF's "(... Rupees [and ... Paise] Only)" line, built once per amount."""
+    if paise:
+        amount_words = f"{_num_words(rupees)} Rupees and {_num_words(paise)} Paise"
+    else:
+        amount_words = f"{_num_words(rupees)} Rupees"
+    # Title-case and wrap
+    return f"({amount_words.title()} Only)"
+
+
+@lru_cache(maxsize=None)
+def _days_in_month(year, month):
+    return calendar.monthrange(year, month)[1]
+
+
+@lru_cache(maxsize=4096)
+def _parse_ddmmyyyy(date_str):
+    """DD-MM-YYYY -> datetime (raises ValueError). Results are immutable, so safe to share."""
+    # Fast path for the canonical zero-padded form; datetime() still range-checks day/month
+    if len(date_str) == 10 and date_str[2] == '-' and date_str[5] == '-':
+        d, m, y = date_str[0:2], date_str[3:5], date_str[6:10]
+        if d.isdigit() and m.isdigit() and y.isdigit():
+            return datetime.datetime(int(y), int(m), int(d))
+    # Anything else (e.g. "1-4-2025") keeps strptime's exact semantics
+    return datetime.datetime.strptime(date_str, '%d-%m-%Y')
+
+
+def validate_email(email):
+    """Validate email format"""
+    return _EMAIL_RE.match(email) is not None
+
+
+def validate_date(date_str):
+    """Validate date format (DD-MM-YYYY)"""
+    try:
+        _parse_ddmmyyyy(date_str)
+        return True
+    except ValueError:
+        return False
+
+
+def _compute_tax(annual_income):
+    """
+    Annual tax for one income -> (taxable_income, tax_before_cess, cess, total_tax).
+    Plain floats in and out, no instance state, so batch callers can map it directly.
+    """
+    # Standard deduction and taxable income calculation
+    taxable_income = annual_income - STANDARD_DEDUCTION
+    tax = _slab_tax(taxable_income)
+
+    rebate_applied = annual_income <= REBATE_LIMIT
+    marginal_relief = REBATE_LIMIT < annual_income <= MARGINAL_RELIEF_LIMIT
+
+    # Apply rebate: No tax if annual income is up to ₹12.75 lakh (mask, no branch)
+    tax *= not rebate_applied
+
+    # Compute initial cess at 4% of the computed tax
+    cess = tax * CESS_RATE
+    total_tax = tax + cess
+
+    # Marginal relief (₹12.75 lakh - ₹15 lakh): tax never exceeds the income above the rebate limit
+    if marginal_relief:
+        total_tax = min(total_tax, annual_income - REBATE_LIMIT)
+
+    return taxable_income, tax, cess, total_tax
+
+
+def _parse_tds(value):
+    """Monthly TDS as passed in; missing or non-numeric means 0."""
+    try:
+        return float(value) if value is not None else 0.0
+    except (ValueError, TypeError):
+        return 0.0
+
+
+@dataclass(slots=True)
+class SalarySummary:
+    """One employee's row in a batch run (raw floats; money is formatted only in PDFs)."""
+    full_name: str
+    emp_no: str
+    total_days: int
+    working_days: float
+    lop: float
+    gross_earnings: float
+    total_deductions: float
+    net_payable: float
+    annual_income: float
+    annual_net_payable: float
+    estimated_annual_tax: float
+
+
+def _summary_number(value, idx, field):
+    """float(value), or ValueError naming the offending employees[idx] field."""
+    if isinstance(value, bool):
+        value = None  # float(True) == 1.0; not a real amount
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        raise ValueError(f"employees[{idx}]: {field} must be a number") from None
+
+
+def _batch_salary_summary(employees, current_date=None):
+    """
+    SalarySummary rows (raw floats, no PDF) for a list of employee_data payloads.
+    The pay month is resolved once for the batch; per-employee math matches
+    SalarySlipGenerator.calculate_salary, plus the slab-computed annual tax.
+    Malformed input raises ValueError ("employees[i]: ...") so the route answers 400.
+    """
+    if current_date and not (isinstance(current_date, str) and validate_date(current_date)):
+        raise ValueError("Invalid date format for current_date. Use DD-MM-YYYY")
+    when = _parse_ddmmyyyy(current_date) if current_date else datetime.datetime.now()
+    total_days = _days_in_month(when.year, when.month)
+    allowed = _ALLOWED_EARNINGS
+    compute_tax = _compute_tax
+
+    rows = []
+    append = rows.append
+    for idx, emp in enumerate(employees):
+        if not isinstance(emp, dict):
+            raise ValueError(f"employees[{idx}]: employee_data must be an object")
+        structure = emp.get('salary_structure')
+        if not isinstance(structure, list) or not structure:
+            raise ValueError(f"employees[{idx}]: salary structure must be a non-empty list")
+
+        gross = 0.0
+        for j, item in enumerate(structure):
+            if not isinstance(item, dict) or not isinstance(item.get('name'), str):
+                raise ValueError(f"employees[{idx}]: salary_structure[{j}] must be an object with a name")
+            amount = _summary_number(item.get('amount'), idx, f"salary_structure[{j}] amount")
+            if item['name'] in allowed:
+                gross += amount
+        tds = _parse_tds(emp.get('Tax Deduction at Source (TDS)'))
+        net = gross - tds
+        annual = gross * 12
+        lop = _summary_number(emp.get('lop', 0), idx, "lop")
+
+        append(SalarySummary(
+            emp.get('full_name', ''),
+            emp.get('emp_no', ''),
+            total_days,
+            total_days - lop,
+            lop,
+            gross,
+            tds,
+            net,
+            annual,
+            net * 12,
+            compute_tax(annual)[3],
+        ))
+    return rows
+
+
+def _pdf_bytes(pdf):
+    """Rendered document as bytes: fpdf 1.x returns a latin-1 str, fpdf2 a bytearray."""
+    out = pdf.output(dest='S')  # 'S' means return in memory
+    if isinstance(out, str):
+        return out.encode('latin-1')
+    return bytes(out)
+
+
+_LEXEND_FILES = (('', os.path.join('static', 'Lexend-Regular.ttf')),
+                 ('B', os.path.join('static', 'Lexend-Bold.ttf')))
+
+# (fonts, font_files) entries fpdf built for Lexend, snapshotted from the first PDF
+_LEXEND_STATE = None
+
+
+def _register_lexend(pdf):
+    """
+    add_font('Lexend') parses the TTF (or its .pkl metrics cache) on every call.
+    Do it once per process and give later PDFs copies of the resulting entries;
+    'subset' is per-document (glyphs used), so each PDF gets its own list.
+    """
+    global _LEXEND_STATE
+    if _LEXEND_STATE is None:
+        for style, path in _LEXEND_FILES:
+            pdf.add_font('Lexend', style, path, uni=True)
+        _LEXEND_STATE = (
+            {k: dict(v, subset=copy.copy(v['subset'])) for k, v in pdf.fonts.items()},
+            {k: dict(v) for k, v in pdf.font_files.items()},
+        )
+        return
+
+    fonts, font_files = _LEXEND_STATE
+    for key, spec in fonts.items():
+        pdf.fonts[key] = dict(spec, subset=copy.copy(spec['subset']))
+    for key, spec in font_files.items():
+        pdf.font_files[key] = dict(spec)
+
+
+# Filler for the shorter side of the earnings/deductions table
+_BLANK_ROW = {'name': '', 'amount': ''}
+
+
 class ImprovedSalarySlipPDF(FPDF):
     """An improved PDF class for better-looking salary slips"""
     def __init__(self, company_info=None):
@@ -27,9 +322,8 @@ class ImprovedSalarySlipPDF(FPDF):
         self.company_info = company_info or {}
         
         # ─── Register Lexend fonts ───────────────────────────────────────────────
-        # Make sure you have placed Lexend-Regular.ttf and Lexend-Bold.ttf under static/fonts/
-        self.add_font('Lexend', '', os.path.join('static', 'Lexend-Regular.ttf'), uni=True)
-        self.add_font('Lexend', 'B', os.path.join('static', 'Lexend-Bold.ttf'), uni=True)
+        # Make sure you have placed Lexend-Regular.ttf and Lexend-Bold.ttf under static/
+        _register_lexend(self)
         # Set Lexend as the default throughout
         self.set_font('Lexend', '', 11)
         self.set_auto_page_break(auto=True, margin=15)
@@ -42,20 +336,12 @@ class ImprovedSalarySlipPDF(FPDF):
         self.left_margin = 15
         self.right_margin = 15
         self.set_margins(self.left_margin, 10, self.right_margin)
-        self.logo_path = None
-        logo_url = 'https://www.enoylitystudio.com/wp-content/uploads/2024/02/enoylity-final-logo.png'
-        local_logo = 'enoylity-final-logo.png'
-        if not os.path.isfile(local_logo):
-            try:
-                resp = requests.get(logo_url, timeout=5)
-                resp.raise_for_status()
-                with open(local_logo, 'wb') as f:
-                    f.write(resp.content)
-            except Exception:
-                # if fetch fails, we'll just skip the logo
-                pass
-        if os.path.isfile(local_logo):
-            self.logo_path = local_logo
+        # Resolved once at startup (_ensure_logo); None means no logo
+        self.logo_path = LOGO_PATH
+        if self.logo_path and _LOGO_INFO is not None:
+            # Seed fpdf's per-document image table so header() doesn't re-read and re-parse the PNG.
+            # Copy: _putimages drops 'data'/'smask' from the entry when the document is written.
+            self.images[self.logo_path] = dict(_LOGO_INFO)
 
     def header(self):
         # Company name from settings - Use company_title if available, otherwise fallback
@@ -70,6 +356,7 @@ class ImprovedSalarySlipPDF(FPDF):
             logo_w = 40  # mm width
             x_pos = self.w - self.right_margin - logo_w
             self.image(self.logo_path, x=x_pos, y=10, w=logo_w)
+            _remember_logo_info(self.images[self.logo_path])
 
         # Rest of your header (line, address, etc.) - using settings data
         self.ln(15)
@@ -115,6 +402,31 @@ class ImprovedSalarySlipPDF(FPDF):
                 return 0.0
         return 0.0  # Default return for other cases
 
+    def _kv_rows(self, rows, label_w, value_w, row_h=6):
+        """
+        Grid of (label, value) pairs, one tuple of pairs per line, starting at the cursor.
+        All labels are drawn first, then all values, so the font/colour switch twice
+        rather than around every cell. Leaves the cursor at the start of the next line.
+        """
+        pair_w = label_w + value_w
+        x0, y0 = self.left_margin, self.get_y()
+
+        self.set_font('Lexend', 'B', 9)
+        self.set_text_color(*self.secondary_color)
+        for r, row in enumerate(rows):
+            for c, (label, _) in enumerate(row):
+                self.set_xy(x0 + c * pair_w, y0 + r * row_h)
+                self.cell(label_w, row_h, label, 0, 0)
+
+        self.set_font('Lexend', '', 9)
+        self.set_text_color(0, 0, 0)
+        for r, row in enumerate(rows):
+            for c, (_, value) in enumerate(row):
+                self.set_xy(x0 + c * pair_w + label_w, y0 + r * row_h)
+                self.cell(value_w, row_h, value, 0, 0)
+
+        self.set_xy(x0, y0 + len(rows) * row_h)
+
     def create_salary_slip(self, data):
         self.add_page()
         
@@ -139,79 +451,15 @@ class ImprovedSalarySlipPDF(FPDF):
         left_col_width = 33
         data_col_width = 52
         
-        # Create 2 column layout with improved visual hierarchy
-        self.set_font('Lexend', 'B', 9)
-        self.set_text_color(*self.secondary_color)
-        self.cell(left_col_width, 6, 'Employee Name:', 0, 0)
-        self.set_font('Lexend', '', 9)
-        self.set_text_color(0, 0, 0)
-        self.cell(data_col_width, 6, employee['full_name'], 0, 0)
-        
-        self.set_font('Lexend', 'B', 9)
-        self.set_text_color(*self.secondary_color)
-        self.cell(left_col_width, 6, 'Employee No:', 0, 0)
-        self.set_font('Lexend', '', 9)
-        self.set_text_color(0, 0, 0)
-        self.cell(data_col_width, 6, str(employee['emp_no']), 0, 1)
-        
-        self.set_font('Lexend', 'B', 9)
-        self.set_text_color(*self.secondary_color)
-        self.cell(left_col_width, 6, 'Designation:', 0, 0)
-        self.set_font('Lexend', '', 9)
-        self.set_text_color(0, 0, 0)
-        self.cell(data_col_width, 6, employee['designation'], 0, 0)
-        
-        self.set_font('Lexend', 'B', 9)
-        self.set_text_color(*self.secondary_color)
-        self.cell(left_col_width, 6, 'Department:', 0, 0)
-        self.set_font('Lexend', '', 9)
-        self.set_text_color(0, 0, 0)
-        self.cell(data_col_width, 6, employee['department'], 0, 1)
-        
-        self.set_font('Lexend', 'B', 9)
-        self.set_text_color(*self.secondary_color)
-        self.cell(left_col_width, 6, 'Date of Joining:', 0, 0)
-        self.set_font('Lexend', '', 9)
-        self.set_text_color(0, 0, 0)
-        self.cell(data_col_width, 6, employee['doj'], 0, 0)
-        
-        self.set_font('Lexend', 'B', 9)
-        self.set_text_color(*self.secondary_color)
-        self.cell(left_col_width, 6, 'Bank Name:', 0, 0)
-        self.set_font('Lexend', '', 9)
-        self.set_text_color(0, 0, 0)
-        self.cell(data_col_width, 6, str(employee['bank_name']), 0, 1)
-        
-        self.set_font('Lexend', 'B', 9)
-        self.set_text_color(*self.secondary_color)
-        self.cell(left_col_width, 6, 'Paid Days', 0, 0)
-        self.set_font('Lexend', '', 9)
-        self.set_text_color(0, 0, 0)
-        self.cell(data_col_width, 6, str(employee['working_days']), 0, 0)
-        
-        self.set_font('Lexend', 'B', 9)
-        self.set_text_color(*self.secondary_color)
-        self.cell(left_col_width, 6, 'Bank Account:', 0, 0)
-        self.set_font('Lexend', '', 9)
-        self.set_text_color(0, 0, 0)
-        self.cell(data_col_width, 6, str(employee['bank_account']), 0, 1)
-        
-        # Add space after employee details
-        self.set_x(self.left_margin)
-        self.set_font('Lexend', 'B', 9)
-        self.set_text_color(*self.secondary_color)
-        self.cell(left_col_width, 6, 'LOP Days:', 0, 0)
-        self.set_font('Lexend', '', 9)
-        self.set_text_color(0, 0, 0)
-        self.cell(data_col_width, 6, str(employee['lop']), 0, 0)
-        
-
-        self.set_font('Lexend', 'B', 9)
-        self.set_text_color(*self.secondary_color)
-        self.cell(left_col_width, 6, 'PAN:', 0, 0)
-        self.set_font('Lexend', '', 9)
-        self.set_text_color(0, 0, 0)
-        self.cell(data_col_width, 6, str(employee['pan']), 0, 1)
+        # Create 2 column layout with improved visual hierarchy: two label/value pairs per row
+        rows = (
+            (('Employee Name:', employee['full_name']), ('Employee No:', str(employee['emp_no']))),
+            (('Designation:', employee['designation']), ('Department:', employee['department'])),
+            (('Date of Joining:', employee['doj']), ('Bank Name:', str(employee['bank_name']))),
+            (('Paid Days', str(employee['working_days'])), ('Bank Account:', str(employee['bank_account']))),
+            (('LOP Days:', str(employee['lop'])), ('PAN:', str(employee['pan']))),
+        )
+        self._kv_rows(rows, left_col_width, data_col_width)
 
         self.ln(10)
         
@@ -254,42 +502,33 @@ class ImprovedSalarySlipPDF(FPDF):
         deductions = [item for item in data['salary_details'].get('deductions', []) 
                     if item['name'] != 'Professional Tax']
         
-        max_rows = max(len(earnings), len(deductions))
-        
-        # Add rows with alternating background
-        for i in range(max_rows):
-            # Add light background for even rows
-            if i % 2 == 0:
-                fill = True
-                self.set_fill_color(240, 240, 250)  # Very light blue
-            else:
-                fill = False
+        # Add rows with alternating background; the shorter column is padded with blank cells.
+        # Only even rows are filled, so the colour is set once (add_page restores it after
+        # header()). The 2mm indent is a set_x per row, not a page margin, so a row that
+        # breaks onto a new page leaves that page's header/footer where they belong.
+        self.set_fill_color(240, 240, 250)  # Very light blue
+        for i, (earn, ded) in enumerate(zip_longest(earnings, deductions, fillvalue=_BLANK_ROW)):
+            fill = i % 2 == 0
             
             # Set X position for consistent margins
             self.set_x(self.left_margin + 2)
             
             # Earnings columns
-            if i < len(earnings):
-                item = earnings[i]
-                self.cell(col1, 7, item['name'], 'LR', 0, fill=fill)
-                self.cell(col2, 7, item['amount'], 'LR', 0, 'R', fill=fill)
-            else:
-                self.cell(col1, 7, '', 'LR', 0, fill=fill)
-                self.cell(col2, 7, '', 'LR', 0, fill=fill)
+            self.cell(col1, 7, earn['name'], 'LR', 0, fill=fill)
+            self.cell(col2, 7, earn['amount'], 'LR', 0, 'R', fill=fill)
             
             # Deductions columns
-            if i < len(deductions):
-                item = deductions[i]
-                self.cell(col3, 7, item['name'], 'LR', 0, fill=fill)
-                self.cell(col4, 7, item['amount'], 'LR', 0, 'R', fill=fill)
-            else:
-                self.cell(col3, 7, '', 'LR', 0, fill=fill)
-                self.cell(col4, 7, '', 'LR', 0, fill=fill)
+            self.cell(col3, 7, ded['name'], 'LR', 0, fill=fill)
+            self.cell(col4, 7, ded['amount'], 'LR', 0, 'R', fill=fill)
             
             self.ln()
         
         # Recalculate total deductions without Professional Tax - FIXED to handle float values
-        total_deductions_amount = sum(self.safe_float(item['amount']) for item in deductions)
+        # Use the raw 'amount_value' calculate_salary carries; parse the display string only for other payloads
+        total_deductions_amount = sum(
+            item['amount_value'] if 'amount_value' in item else self.safe_float(item['amount'])
+            for item in deductions
+        )
         
         # Total row with highlighting
         self.set_x(self.left_margin + 2)
@@ -301,7 +540,10 @@ class ImprovedSalarySlipPDF(FPDF):
         self.cell(col4, 8, f"Rs. {total_deductions_amount:.2f}", 1, 1, 'R', fill=True)
         
         # Recalculate net payable - FIXED to handle float values
-        gross_earnings = self.safe_float(data['salary_details']['gross_earnings'])
+        salary_details = data['salary_details']
+        gross_earnings = salary_details.get('gross_value')
+        if gross_earnings is None:
+            gross_earnings = self.safe_float(salary_details['gross_earnings'])
         net_payable = gross_earnings - total_deductions_amount
         annual_net_payable = net_payable * 12
         
@@ -321,17 +563,7 @@ class ImprovedSalarySlipPDF(FPDF):
         # Integer rupees and optional paise
         rupees = int(net_payable)
         paise = round((net_payable - rupees) * 100)
-
-        # Build the words
-        if paise:
-            rupee_words = num2words(rupees, lang='en_IN')
-            paise_words = num2words(paise, lang='en_IN')
-            amount_words = f"{rupee_words} Rupees and {paise_words} Paise"
-        else:
-            amount_words = f"{num2words(rupees, lang='en_IN')} Rupees"
-
-        # Title‑case and wrap
-        amount_in_words = f"({amount_words.title()} Only)"
+        amount_in_words = _rupees_in_words(rupees, paise)
         self.cell(0, 7, amount_in_words, 0, 1)
         
         # Add tax notes if applicable
@@ -344,17 +576,22 @@ class ImprovedSalarySlipPDF(FPDF):
 
 
 class SalarySlipGenerator:
-    def __init__(self, employee_data, current_date=None):
+    __slots__ = ('employee_data', 'salary_details', 'tax_details',
+                 'company_settings', 'current_date', 'annual_salary')
+
+    def __init__(self, employee_data, current_date=None, company_settings=None):
         self.employee_data = employee_data
         self.salary_details = {}
         self.tax_details = {}
         
-        # Fetch company settings from database
-        self.company_settings = get_current_salary_settings()
+        # Fetch company settings from database (batch callers pass them in once)
+        if company_settings is None:
+            company_settings = _salary_settings()
+        self.company_settings = company_settings
         
         # Set current date
         if current_date:
-            self.current_date = datetime.datetime.strptime(current_date, '%d-%m-%Y')
+            self.current_date = _parse_ddmmyyyy(current_date)
         else:
             self.current_date = datetime.datetime.now()
         
@@ -362,84 +599,27 @@ class SalarySlipGenerator:
         self.employee_data['current_year'] = self.current_date.year
         
         # Calculate total days in the month
-        days_in_month = calendar.monthrange(self.employee_data['current_year'], 
-                                           self.employee_data['current_month'])[1]
+        days_in_month = _days_in_month(self.employee_data['current_year'],
+                                       self.employee_data['current_month'])
         self.employee_data['total_days'] = days_in_month
         self.employee_data['working_days'] = days_in_month - self.employee_data.get('lop', 0)
     
-    def validate_email(self, email):
-        """Validate email format"""
-        pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        return re.match(pattern, email) is not None
-    
-    def validate_date(self, date_str):
-        """Validate date format (DD-MM-YYYY)"""
-        try:
-            datetime.datetime.strptime(date_str, '%d-%m-%Y')
-            return True
-        except ValueError:
-            return False
+    # Kept for existing callers; the checks don't need an instance
+    validate_email = staticmethod(validate_email)
+    validate_date = staticmethod(validate_date)
     
     def calculate_tax(self):
-        """Calculate income tax based on annual salary"""
+        """
+        Calculate income tax based on annual salary.
+        Not called by calculate_salary (slips deduct the TDS passed in); the live slab
+        computation is _compute_tax, which _batch_salary_summary uses for its estimate.
+        """
         # Calculate annual income from salary structure
         annual_income = self.annual_salary
         
-        # Standard deduction and taxable income calculation
-        standard_deduction = 75000
-        taxable_income = annual_income - standard_deduction
-        tax = 0
-
-        # Compute tax only if taxable income exceeds ₹4,00,000
-        if taxable_income > 400000:
-            remaining_income = taxable_income - 400000
-
-            # Slab 1: ₹4,00,001 to ₹8,00,000 @ 5%
-            slab = min(remaining_income, 400000)
-            tax += slab * 0.05
-            remaining_income -= slab
-
-            # Slab 2: ₹8,00,001 to ₹12,00,000 @ 10%
-            if remaining_income > 0:
-                slab = min(remaining_income, 400000)
-                tax += slab * 0.10
-                remaining_income -= slab
-
-            # Slab 3: ₹12,00,001 to ₹16,00,000 @ 15%
-            if remaining_income > 0:
-                slab = min(remaining_income, 400000)
-                tax += slab * 0.15
-                remaining_income -= slab
-
-            # Slab 4: ₹16,00,001 to ₹20,00,000 @ 20%
-            if remaining_income > 0:
-                slab = min(remaining_income, 400000)
-                tax += slab * 0.20
-                remaining_income -= slab
-
-            # Slab 5: ₹20,00,001 to ₹24,00,000 @ 25%
-            if remaining_income > 0:
-                slab = min(remaining_income, 400000)
-                tax += slab * 0.25
-                remaining_income -= slab
-
-            # Slab 6: Above ₹24,00,000 @ 30%
-            if remaining_income > 0:
-                tax += remaining_income * 0.30
-
-        # Apply rebate: No tax if annual income is up to ₹12.75 lakh
-        if annual_income <= 1275000:
-            tax = 0
-
-        # Compute initial cess at 4% of the computed tax
-        cess = tax * 0.04
-        total_tax = tax + cess
-
-        # Apply marginal relief for annual incomes between ₹12.75 lakh and ₹15 lakh.
-        if 1275000 < annual_income <= 1500000:
-            income_above_limit = annual_income - 1275000
-            if total_tax > income_above_limit:
-                total_tax = income_above_limit
+        taxable_income, tax, cess, total_tax = _compute_tax(annual_income)
+        rebate_applied = annual_income <= REBATE_LIMIT
+        marginal_relief = REBATE_LIMIT < annual_income <= MARGINAL_RELIEF_LIMIT
 
         # Store the tax details
         self.tax_details['taxable_income'] = taxable_income
@@ -447,8 +627,8 @@ class SalarySlipGenerator:
         self.tax_details['cess'] = cess
         self.tax_details['annual_tax'] = total_tax
         self.tax_details['monthly_tax'] = total_tax / 12
-        self.tax_details['rebate_applied'] = annual_income <= 1275000
-        self.tax_details['marginal_relief_applicable'] = 1275000 < annual_income <= 1500000
+        self.tax_details['rebate_applied'] = rebate_applied
+        self.tax_details['marginal_relief_applicable'] = marginal_relief
         
     
     def calculate_salary(self):
@@ -459,41 +639,28 @@ class SalarySlipGenerator:
         lop_days         = self.employee_data.get('lop', 0)
 
         # 2) Allowed components
-        allowed = {
-            'Basic Pay', 'House Rent Allowance',
-            'Performance Bonus', 'Overtime Bonus', 'Special Allowance'
-        }
+        allowed = _ALLOWED_EARNINGS
 
-        # 3) Build earnings list
+        # 3) Build earnings list and 4) gross monthly post-LOP, in one pass
         earnings = []
+        gross_monthly = 0.0
         for item in salary_structure:
             name   = item['name']
             amount = float(item['amount'])
             if name not in allowed:
                 continue
+            gross_monthly += amount
             earnings.append({
                 'name':   name,
-                'amount': f"Rs. {amount:.2f}"
+                'amount': _rs(amount),
+                'amount_value': amount
             })
 
-        # 4) Gross monthly post-LOP
-        gross_monthly = sum(
-            float(e['amount'].replace('Rs. ', '')) for e in earnings
-        )
-
-        # 5) For annual tax calculations (if ever needed)
-        full_gross = sum(
-            float(item['amount']) for item in salary_structure
-            if item['name'] in allowed
-        )
-        self.annual_salary = full_gross * 12
+        # 5) For annual tax calculations (if ever needed); earnings aren't pro-rated, so this is the same gross
+        self.annual_salary = gross_monthly * 12
 
         # 6) TDS: use passed-in if provided; else zero
-        tds_passed = self.employee_data.get('Tax Deduction at Source (TDS)')
-        try:
-            monthly_tax = float(tds_passed) if tds_passed is not None else 0.0
-        except (ValueError, TypeError):
-            monthly_tax = 0
+        monthly_tax = _parse_tds(self.employee_data.get('Tax Deduction at Source (TDS)'))
 
         # record it in tax_details
         self.tax_details = {
@@ -511,41 +678,29 @@ class SalarySlipGenerator:
         if monthly_tax >= 0:
             deductions.append({
                 'name':   'Income Tax (TDS)',
-                'amount': f"Rs. {monthly_tax:.2f}"
+                'amount': _rs(monthly_tax),
+                'amount_value': monthly_tax
             })
 
         # 8) Compute net payable
         net_payable = gross_monthly - monthly_tax
 
-        # 9) Store into salary_details
-        self.salary_details = {
-            'earnings':         earnings,
-            'deductions':       deductions,
-            'gross_earnings':   f"Rs. {gross_monthly:.2f}",
-            'total_deductions': f"Rs. {monthly_tax:.2f}",
-            'net_payable':      f"Rs. {net_payable:.2f}",
-            'annual_income':    f"Rs. {self.annual_salary:.2f}",
-            'annual_net_payable': f"Rs. {(net_payable*12):.2f}",
-            'amount_in_words':    f"{num2words(int(net_payable), lang='en_IN').title()} Only"
-        }
+        # 9) Store into salary_details, formatting all money fields in one pass
+        amounts = (gross_monthly, monthly_tax, net_payable, self.annual_salary, net_payable * 12)
+        self.salary_details = {'earnings': earnings, 'deductions': deductions}
+        for key, value in zip(_SALARY_MONEY_KEYS, amounts):
+            self.salary_details[key] = _rs(value)
+        self.salary_details['gross_value'] = gross_monthly  # raw float, so the PDF needn't re-parse
+        self.salary_details['amount_in_words'] = f"{_num_words(int(net_payable)).title()} Only"
 
 
         return  # if you were returning tax_notes before, you can still return self.tax_details or None
 
 
     
-    def calculate_experience(self):
-        """Calculate experience based on date of joining"""
-        doj = datetime.datetime.strptime(self.employee_data['doj'], '%d-%m-%Y')
-        current_date = self.current_date
-        
-        experience = relativedelta(current_date, doj)
-        return experience
-    
     def generate_salary_data(self):
         """Generate salary data in dictionary format"""
         tax_notes = self.calculate_salary()
-        experience = self.calculate_experience()
         
         # Format current date for the slip
         slip_date = self.current_date.strftime('%d-%m-%Y')
@@ -554,24 +709,27 @@ class SalarySlipGenerator:
         # Use company name from settings if available
         company_name = self.company_settings.get('company_name', 'Enoylity Media Creations')
         
+        ed = self.employee_data
+        get = ed.get
+
         # Prepare result dictionary
         result = {
             "employee_details": {
-                "full_name": self.employee_data['full_name'],
-                "designation": self.employee_data.get('designation', 'Employee'),
-                "doj": self.employee_data['doj'],
-                "emp_no": self.employee_data.get('emp_no', ''),
-                "department": self.employee_data.get('department', ''),
-                "bank_account": self.employee_data.get('bank_account', ''),
-                "bank_name":self.employee_data.get('bank_name',''),
-                "pan": self.employee_data.get('pan', ''),
-                "working_days": self.employee_data['working_days'],
-                "lop": self.employee_data.get('lop', 0),
-                "month_salary": self.employee_data.get('monthly_salary')
+                "full_name": ed['full_name'],
+                "designation": get('designation', 'Employee'),
+                "doj": ed['doj'],
+                "emp_no": get('emp_no', ''),
+                "department": get('department', ''),
+                "bank_account": get('bank_account', ''),
+                "bank_name": get('bank_name', ''),
+                "pan": get('pan', ''),
+                "working_days": ed['working_days'],
+                "lop": get('lop', 0),
+                "month_salary": get('monthly_salary')
             },
             "salary_details": self.salary_details,
             "tax_details": self.tax_details,
-            "pay_period": f"{month_name} {self.employee_data['current_year']}",
+            "pay_period": f"{month_name} {ed['current_year']}",
             "generated_on": slip_date,
             "company_name": company_name,
             "tax_notes": tax_notes
@@ -579,21 +737,147 @@ class SalarySlipGenerator:
         
         return result
     
-    def generate_pdf(self):
-        """Generate PDF salary slip"""
+    def generate_pdf_bytes(self):
+        """Generate PDF salary slip as bytes"""
         salary_data = self.generate_salary_data()
         
         # Use our improved PDF class with company settings
         pdf = ImprovedSalarySlipPDF(company_info=self.company_settings)
         pdf.create_salary_slip(salary_data)
-        
-        # Save PDF to a bytes buffer
-        pdf_buffer = io.BytesIO()
-        pdf_bytes = pdf.output(dest='S').encode('latin-1')  # 'S' means return as string
-        pdf_buffer.write(pdf_bytes)
-        pdf_buffer.seek(0)
-        
-        return pdf_buffer
+        return _pdf_bytes(pdf)
+
+    def generate_pdf(self):
+        """Generate PDF salary slip as a file-like buffer (for send_file)"""
+        # Wrap the PDF bytes without copying; BytesIO(initial) shares the buffer until written to
+        return io.BytesIO(self.generate_pdf_bytes())
+
+
+# Batches at least this large are rendered across worker processes
+BATCH_PARALLEL_MIN = 4
+# Render processes per web worker; keep (web workers x this) within the host's cores
+BATCH_MAX_WORKERS = max(1, int(os.getenv("SALARY_RENDER_WORKERS") or 2))
+# Largest payroll run one batch request may render
+BATCH_MAX_SLIPS = 500
+# Batch zips larger than this are spooled to a temp file instead of RAM
+BATCH_ZIP_SPOOL_BYTES = 1 << 20
+
+
+def _validate_employee_data(employee_data):
+    """Error message for an unusable employee_data payload, or None."""
+    # Required fields
+    for field in ('full_name', 'doj', 'salary_structure'):
+        if field not in employee_data:
+            return f"Missing required field: {field}"
+
+    # Salary structure must be a non-empty list
+    if not isinstance(employee_data['salary_structure'], list) or not employee_data['salary_structure']:
+        return "Salary structure must be a non-empty list"
+
+    if not validate_date(employee_data['doj']):
+        return "Invalid date format for doj. Use DD-MM-YYYY"
+    return None
+
+
+def _slip_filename(employee_data):
+    return f"salary_slip_{employee_data['full_name'].replace(' ', '_')}.pdf"
+
+
+def _with_lop(employee_data):
+    """Copy of employee_data with LOP defaulted to 0; the request payload is left untouched."""
+    return {**employee_data, 'lop': employee_data.get('lop', 0)}
+
+
+def _init_render_worker(logo_path):
+    # spawned workers start from a fresh import, so take the parent's resolved logo
+    global LOGO_PATH
+    LOGO_PATH = logo_path
+
+
+def _render_slip(job):
+    """
+    Pool worker: (employee_data, current_date, company_settings) -> (filename, pdf bytes).
+    Module-level so it pickles; settings come from the parent, so workers never query Mongo.
+    """
+    employee_data, current_date, company_settings = job
+    generator = SalarySlipGenerator(employee_data, current_date=current_date,
+                                    company_settings=company_settings)
+    return _slip_filename(employee_data), generator.generate_pdf_bytes()
+
+
+# One process pool shared by every batch request, created on first use
+_RENDER_POOL = None
+_RENDER_POOL_LOCK = threading.Lock()
+
+
+def _render_pool():
+    """
+    The shared render pool. 'spawn' rather than fork: request threads (and the Mongo
+    client's monitors) are already running, and forking a threaded process can deadlock.
+    """
+    global _RENDER_POOL
+    with _RENDER_POOL_LOCK:
+        if _RENDER_POOL is None:
+            _RENDER_POOL = multiprocessing.get_context('spawn').Pool(
+                BATCH_MAX_WORKERS, initializer=_init_render_worker, initargs=(LOGO_PATH,))
+            atexit.register(_close_render_pool)
+        return _RENDER_POOL
+
+
+def _close_render_pool():
+    """Let the workers finish queued slips and exit (registered with atexit)."""
+    global _RENDER_POOL
+    with _RENDER_POOL_LOCK:
+        pool, _RENDER_POOL = _RENDER_POOL, None
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+
+def _render_slips(jobs):
+    """
+    Yield (filename, pdf bytes) per job in order, fanning out over the shared pool for
+    larger batches. Results are yielded as they arrive so callers can write them out
+    without holding the whole run in memory.
+    """
+    if len(jobs) < BATCH_PARALLEL_MIN:
+        for job in jobs:
+            yield _render_slip(job)
+        return
+    yield from _render_pool().imap(_render_slip, jobs)
+
+
+# Rendered single-slip PDFs by request fingerprint (also the ETag), least recently used first
+PDF_CACHE_MAX = 128
+_PDF_CACHE = OrderedDict()
+_PDF_CACHE_LOCK = threading.Lock()
+
+
+def _slip_etag(raw_body, current_date, company_settings):
+    """
+    Fingerprint of everything that goes into one slip's PDF: the request body as sent
+    (never re-serialized, so any JSON the route accepted hashes) plus the resolved date,
+    settings and logo.
+    """
+    digest = hashlib.blake2b(raw_body, digest_size=16)
+    extra = json.dumps([current_date, company_settings, LOGO_PATH], sort_keys=True, default=str)
+    digest.update(extra.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _pdf_cache_get(key):
+    with _PDF_CACHE_LOCK:
+        pdf_bytes = _PDF_CACHE.get(key)
+        if pdf_bytes is not None:
+            _PDF_CACHE.move_to_end(key)
+        return pdf_bytes
+
+
+def _pdf_cache_put(key, pdf_bytes):
+    with _PDF_CACHE_LOCK:
+        _PDF_CACHE[key] = pdf_bytes
+        _PDF_CACHE.move_to_end(key)
+        while len(_PDF_CACHE) > PDF_CACHE_MAX:
+            _PDF_CACHE.popitem(last=False)
 
 
 # Routes remain the same...
@@ -624,38 +908,110 @@ def generate_salary_slip():
         if not employee_data:
             return format_response(False, "Missing 'employee_data' in request", status=400)
 
-        # Required fields
-        for field in ('full_name', 'doj', 'salary_structure'):
-            if field not in employee_data:
-                return format_response(False, f"Missing required field: {field}", status=400)
-
-        # Salary structure must be a non-empty list
-        if not isinstance(employee_data['salary_structure'], list) or not employee_data['salary_structure']:
-            return format_response(False, "Salary structure must be a non-empty list", status=400)
+        # Validate before building the generator (it loads settings and sets up the month)
+        error = _validate_employee_data(employee_data)
+        if error:
+            return format_response(False, error, status=400)
 
         # Default LOP to 0 if absent
-        employee_data.setdefault('lop', 0)
+        employee_data = _with_lop(employee_data)
+
+        current_date = payload.get('current_date')
+        if current_date and not validate_date(current_date):
+            return format_response(False, "Invalid date format for current_date. Use DD-MM-YYYY", status=400)
+
+        # Pin the slip date so identical payloads on the same day fingerprint the same
+        current_date = current_date or datetime.datetime.now().strftime('%d-%m-%Y')
+        company_settings = _salary_settings()
+
+        # Repeat payloads (retries, preview then download) reuse the rendered PDF
+        etag = _slip_etag(request.get_data(), current_date, company_settings)
+        if request.if_none_match.contains(etag):
+            not_modified = Response(status=304)
+            not_modified.set_etag(etag)
+            return not_modified
+
+        pdf_bytes = _pdf_cache_get(etag)
+        if pdf_bytes is None:
+            # Instantiate generator (will set up dates & working days)
+            generator = SalarySlipGenerator(employee_data, current_date=current_date,
+                                            company_settings=company_settings)
+            pdf_bytes = generator.generate_pdf_bytes()
+            _pdf_cache_put(etag, pdf_bytes)
 
-        # Instantiate generator (will set up dates & working days)
-        generator = SalarySlipGenerator(
-            employee_data,
-            current_date=payload.get('current_date')
+        # Stream PDF to client
+        return send_file(
+            io.BytesIO(pdf_bytes),
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name=_slip_filename(employee_data),
+            etag=etag
         )
 
-        # Validate date format for DOJ
-        if not generator.validate_date(employee_data['doj']):
-            return format_response(False, "Invalid date format for doj. Use DD-MM-YYYY", status=400)
+    except Exception:
+        return format_response(False, "Internal server error", status=500)
+
 
-        # Generate PDF buffer
-        pdf_buffer = generator.generate_pdf()
+@salary_bp.route('/generate-salary-slips-batch', methods=['POST'])
+def generate_salary_slips_batch():
+    """PDF slips for a whole payroll run, returned as one zip."""
+    try:
+        payload = request.get_json() or {}
+        employees = payload.get('employees')
+
+        if not isinstance(employees, list) or not employees:
+            return format_response(False, "'employees' must be a non-empty list", status=400)
+        if len(employees) > BATCH_MAX_SLIPS:
+            return format_response(False, f"At most {BATCH_MAX_SLIPS} employees per batch", status=400)
+
+        current_date = payload.get('current_date')
+        if current_date and not validate_date(current_date):
+            return format_response(False, "Invalid date format for current_date. Use DD-MM-YYYY", status=400)
+
+        for idx, employee_data in enumerate(employees):
+            error = _validate_employee_data(employee_data) if isinstance(employee_data, dict) \
+                else "employee_data must be an object"
+            if error:
+                return format_response(False, f"employees[{idx}]: {error}", status=400)
+
+        # One settings read for the batch, in this process
+        company_settings = _salary_settings()
+        slips = _render_slips([(_with_lop(e), current_date, company_settings) for e in employees])
+
+        # Spills to disk past BATCH_ZIP_SPOOL_BYTES; send_file then streams it in chunks
+        zip_buffer = tempfile.SpooledTemporaryFile(max_size=BATCH_ZIP_SPOOL_BYTES)
+        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+            # Index prefix keeps names unique when employees share a name
+            for idx, (filename, pdf_bytes) in enumerate(slips, 1):
+                zf.writestr(f"{idx:03d}_{filename}", pdf_bytes)
+        zip_buffer.seek(0)
 
-        # Stream PDF to client
         return send_file(
-            pdf_buffer,
-            mimetype='application/pdf',
+            zip_buffer,
+            mimetype='application/zip',
             as_attachment=True,
-            download_name=f"salary_slip_{employee_data['full_name'].replace(' ', '_')}.pdf"
+            download_name="salary_slips.zip"
         )
 
     except Exception:
-        return format_response(False, "Internal server error", status=500)
\ No newline at end of file
+        return format_response(False, "Internal server error", status=500)
+
+
+@salary_bp.route('/generate-salary-slip-batch', methods=['POST'])
+def generate_salary_slip_batch():
+    """Salary figures for a whole payroll run in one request (JSON, no PDFs)."""
+    try:
+        payload = request.get_json() or {}
+        employees = payload.get('employees')
+
+        if not isinstance(employees, list) or not employees:
+            return format_response(False, "'employees' must be a non-empty list", status=400)
+
+        rows = _batch_salary_summary(employees, payload.get('current_date'))
+        # app.json is the orjson provider, which serializes the dataclasses natively
+        return format_response(True, "Salary data generated", {"employees": rows, "count": len(rows)})
+
+    except ValueError as e:
+        return format_response(False, str(e), status=400)
+    except Exception:
+        return format_response(False, "Internal server error", status=500)
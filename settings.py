@@ -4,6 +4,7 @@ from utils import format_response
 import os
 import random
 import string
+import time
 from datetime import datetime
 from pymongo import ReturnDocument
 import importlib
@@ -283,6 +284,9 @@ def update_salary_settings():
     if result.modified_count == 0:
         return format_response(False, "No changes made to settings", status=400)
 
+    # Next slip in this process picks up the new company info
+    _invalidate_salary_settings()
+
     updated = db.settings_salary.find_one({"settings_id": settings_id})
     updated["_id"] = str(updated.get("_id"))  # convert _id to string if exists
 
@@ -298,9 +302,28 @@ def get_current_settings(invoice_type):
     return {}
 
 
+# Salary slip company info changes rarely; every slip reads it, so keep it per process for a minute
+SALARY_SETTINGS_TTL = 60.0
+_salary_settings_cache = None  # (expires_at monotonic, company_info)
+
+
+def _invalidate_salary_settings():
+    global _salary_settings_cache
+    _salary_settings_cache = None
+
+
 def get_current_salary_settings():
-    """Get current settings for salary slip generation"""
+    """Get current settings for salary slip generation (cached for SALARY_SETTINGS_TTL seconds)"""
+    global _salary_settings_cache
+    now = time.monotonic()
+    cached = _salary_settings_cache
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
     settings = get_or_create_salary_settings()
     if settings:
-        return settings.get("company_info", DEFAULT_SALARY_SLIP_INFO)
-    return DEFAULT_SALARY_SLIP_INFO
\ No newline at end of file
+        info = settings.get("company_info", DEFAULT_SALARY_SLIP_INFO)
+    else:
+        info = DEFAULT_SALARY_SLIP_INFO
+    _salary_settings_cache = (now + SALARY_SETTINGS_TTL, info)
+    return info
\ No newline at end of file
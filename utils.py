@@ -1,9 +1,36 @@
 # Centralized Response Formatter
 
-from flask import jsonify,Blueprint
+from functools import lru_cache
+
+import orjson
+from flask import jsonify,Blueprint,current_app
+from flask.json.provider import DefaultJSONProvider
 utils_bp = Blueprint('utils', __name__, url_prefix="/util")
 
 
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by orjson (C) instead of stdlib json.
+    Same data as the default provider (sorted keys; datetimes/Decimals still go through
+    DefaultJSONProvider.default, so RFC 822 dates and str decimals), but not byte-identical:
+    no trailing newline, and non-ASCII is emitted as UTF-8 rather than \\u-escaped.
+    Only dumps/response are overridden: parsing stays on the stdlib loads, which also
+    accepts big integers and NaN/Infinity that orjson rejects.
+    """
+
+    option = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self.option),
+            mimetype=self.mimetype,
+        )
+
+
 def format_response(success: bool, message: str, data=None, status: int = 200):
     """
     Constructs a standardized API response.
@@ -26,6 +53,22 @@ def format_response(success: bool, message: str, data=None, status: int = 200):
     return jsonify(response), status
 
 
+@lru_cache(maxsize=256)
+def _static_body(success: bool, message: str, status: int) -> bytes:
+    return orjson.dumps(
+        {"success": success, "message": message, "data": None, "status": status},
+        option=orjson.OPT_SORT_KEYS,
+    )
+
+
+def format_static_response(success: bool, message: str, status: int = 200):
+    """
+    format_response for fixed payloads (constant message, no data), e.g. validation
+    failures. The JSON body is built once per (success, message, status) and reused.
+    """
+    return current_app.response_class(_static_body(success, message, status), mimetype="application/json"), status
+
+
 
 @utils_bp.errorhandler(404)
 def resource_not_found(e):